@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+import os
+
+from PySide2.QtCore import QFileSystemWatcher, QObject, QTimer, Signal
+
+from Const import TIMEOUT_BUSY, TIMEOUT_WATCH
+
+
+class ChangeWatcher(QObject):
+
+    # changed is emitted when another process has committed a change to
+    # the database: PRAGMA data_version (which only changes for other
+    # connections' commits) is polled, and checked at once when the file
+    # or its WAL changes on disk
+    changed = Signal()
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self._data_version = None
+        self.fileWatcher = QFileSystemWatcher(self)
+        self.fileWatcher.fileChanged.connect(self.on_file_changed)
+        self.fileTimer = QTimer(self) # Writes come in bursts
+        self.fileTimer.setSingleShot(True)
+        self.fileTimer.setInterval(TIMEOUT_BUSY)
+        self.fileTimer.timeout.connect(self.check)
+        self.pollTimer = QTimer(self)
+        self.pollTimer.setInterval(TIMEOUT_WATCH)
+        self.pollTimer.timeout.connect(self.check)
+
+
+    def start(self):
+        self.stop()
+        if bool(self.db) and not self.db.options.immutable:
+            self._data_version = self.db.data_version()
+            self._watch_files()
+            self.pollTimer.start()
+
+
+    def stop(self):
+        self.pollTimer.stop()
+        self.fileTimer.stop()
+        if files := self.fileWatcher.files():
+            self.fileWatcher.removePaths(files)
+        self._data_version = None
+
+
+    def _watch_files(self): # The WAL comes and goes
+        filename = str(self.db.filename)
+        watched = set(self.fileWatcher.files())
+        if paths := [path for path in (filename, filename + '-wal')
+                     if path not in watched and os.path.exists(path)]:
+            self.fileWatcher.addPaths(paths)
+
+
+    def on_file_changed(self, _path):
+        self.fileTimer.start()
+
+
+    def check(self):
+        if self._data_version is None or not bool(self.db):
+            return
+        self._watch_files()
+        if (version := self.db.data_version()) != self._data_version:
+            self._data_version = version
+            self.changed.emit()
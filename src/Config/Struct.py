@@ -26,13 +26,16 @@ ToggleOptions = collections.namedtuple(
 class DbUi:
 
     def __init__(self, filename, *, mdi=True, show_items_tree=True,
-                 show_pragmas=False, show_calendar=False, windows=None):
+                 show_pragmas=False, show_calendar=False, windows=None,
+                 pragmas=None):
         self.filename = filename
         self.mdi = mdi
         self.show_items_tree = show_items_tree
         self.show_pragmas = show_pragmas
         self.show_calendar = show_calendar
         self.windows = [] if windows is None else windows
+        # Connection pragma name → value to set whenever the file is opened
+        self.pragmas = {} if pragmas is None else pragmas
 
 
     @property
@@ -40,7 +43,8 @@ class DbUi:
         return json.dumps(dict(mdi=self.mdi,
                                show_items_tree=self.show_items_tree,
                                show_pragmas=self.show_pragmas,
-                               show_calendar=self.show_calendar))
+                               show_calendar=self.show_calendar,
+                               pragmas=self.pragmas))
 
 
     def update(self, d):
@@ -48,12 +52,13 @@ class DbUi:
         self.show_items_tree = d.get('show_items_tree', True)
         self.show_pragmas = d.get('show_pragmas', False)
         self.show_calendar = d.get('show_calendar', False)
+        self.pragmas = d.get('pragmas', {})
 
 
 class DbWindowUi:
 
     def __init__(self, title, sql_select, *, x=None, y=None, width=None,
-                 height=None, sizes=None):
+                 height=None, sizes=None, streaming=False):
         self.title = title
         self.sql_select = sql_select
         self.x = x
@@ -61,10 +66,12 @@ class DbWindowUi:
         self.width = width
         self.height = height
         self.sizes = sizes
+        self.streaming = streaming
 
 
     @property
     def to_json(self):
         return json.dumps(dict(title=self.title, sql_select=self.sql_select,
                                x=self.x, y=self.y, width=self.width,
-                               height=self.height, sizes=self.sizes))
+                               height=self.height, sizes=self.sizes,
+                               streaming=self.streaming))
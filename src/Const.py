@@ -6,20 +6,39 @@ import sys
 APPNAME = 'Songbird'
 VERSION = '0.2.4'
 
+BLOB_CHUNK = 1024 * 1024 # 1MB
+COMPLETIONS_MAX = 50 # offered at once
+COMPLETION_PREFIX = 2 # characters typed before completions are offered
+HIGHLIGHT_MARGIN = 100 # blocks beyond those visible when SQL is large
+HIGHLIGHT_SLICE = 2000 # blocks per idle-time step when SQL is large
 LAST_FILE = 'LastFile'
+LAZY_PREFIX = 60 # characters
+LAZY_SIZE = 1000 # bytes or characters
 MAIN_WINDOW_GEOMETRY = 'MainWindow/Geometry'
 MAIN_WINDOW_STATE = 'MainWindow/State'
 MAX_I32 = (2**31) - 1
 OPENED = 'Opened'
+PAGE_CACHE_BYTES = 64 * 1024 * 1024 # 64MB
+PAGE_SIZE = 256 # rows
+PREFETCH_PAGES = 2 # ahead of the scroll direction
+READERS_MAX = 4 # idle read-only connections kept open per database
 RECENT_FILE = 'RecentFile'
 RECENT_FILES_MAX = 9
 SHOW_AS_TABS = 'ShowAsTabs'
 SHOW_ITEMS_TREE = 'ShowItemsTree'
 SHOW_PRAGMAS = 'ShowPragmas'
+STATEMENT_CACHE_SIZE = 256 # prepared statements per connection
+SQL_LARGE = 1024 * 1024 # 1M characters then only visible SQL is styled
 SUFFIX = '.sb'
 SUFFIXES = ('.sqlite', '.sqlite3', '.db', '.db3')
 SUFFIX_DEFAULT = SUFFIXES[0] # Make this a user option
+TIMEOUT_BUSY = 200 # 0.2s
+TIMEOUT_FILTER = 300 # 0.3s
+TIMEOUT_LOCKED = 5000 # 5s waiting for another connection's lock
 TIMEOUT_LONG = 10000 # 10s
 TIMEOUT_SHORT = 5000 # 5s
+TIMEOUT_VALIDATE = 500 # 0.5s pause in typing before SQL is checked
+TIMEOUT_WATCH = 2000 # 2s between checks for other processes' changes
 UNCHANGED = object()
 WIN = sys.platform.startswith('win')
+WORKERS_MAX = 4 # threads (each with a reader) a database's windows share
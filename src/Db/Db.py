@@ -2,22 +2,84 @@
 # Copyright © 2020 Mark Summerfield. All rights reserved.
 
 import functools
+import pathlib
 import re
 
 import apsw
-from Const import UNCHANGED
+from Const import (
+    BLOB_CHUNK, LAZY_PREFIX, LAZY_SIZE, READERS_MAX, STATEMENT_CACHE_SIZE,
+    TIMEOUT_LOCKED, UNCHANGED)
 
 from . import Sql
+from .Schema import Schema
+
+
+def _schema_cached(depends_on):
+    # Caches a Db method's result per argument until refresh() finds that
+    # the item depends_on(argument) returns (or any item if it returns
+    # None) has changed
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, argument):
+            key = (method.__name__, argument)
+            if (cached := self._cache.get(key)) is None:
+                cached = self._cache[key] = (depends_on(argument),
+                                             method(self, argument))
+            return cached[1]
+        return wrapper
+    return decorator
+
+
+def _select_table(select): # The table a simple select reads (if any)
+    if (parts := Sql.simple_select_parts(select)) is not None:
+        return parts[1].strip('"').lower()
+
+
+class _Nulls(dict): # Binds NULL for any parameter a select uses
+
+    def __missing__(self, key):
+        return None
+
+
+def _prepare(db, sql):
+    # Returns the result columns of sql's first statement which is
+    # prepared on the apsw.Connection db but not run
+    columns = []
+
+    def prepared(cursor, sql, bindings):
+        columns.extend(Sql.Column(*column)
+                       for column in cursor.get_description())
+        return False # Abort before the first step
+
+    cursor = db.cursor()
+    cursor.exec_trace = prepared
+    try:
+        cursor.execute(sql, _Nulls())
+    except apsw.ExecTraceAbort:
+        pass
+    except apsw.BindingsError as err: # e.g., ? parameters
+        raise apsw.SQLError(str(err))
+    finally:
+        cursor.close()
+    return tuple(columns)
 
 
 class Db:
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, *, options=Sql.OpenOptions()):
         self._db = None
+        self.options = options
+        self._cursor = None # Reused for every query that's read in full
+        self._readers = [] # Idle read-only connections (see reader())
+        self._lent = set() # Readers in use (see release())
+        self._journal_mode = None # To restore on close if we changed it
+        self.connection_pragmas = {} # Those set by pragmas_save()
+        self._schema = None # See schema
+        self._cache = {} # See _schema_cached()
         if filename is None:
             self._filename = None
         else:
-            self.open(filename)
+            self.open(filename, options=options)
 
 
     def __bool__(self):
@@ -29,73 +91,243 @@ class Db:
         return self._filename
 
 
-    def open(self, filename):
+    def open(self, filename, *, options=Sql.OpenOptions()):
         self.close()
         self._filename = filename
-        self._db = apsw.Connection(str(filename))
+        self.options = options
+        readonly = options.readonly or options.immutable
+        flags = (apsw.SQLITE_OPEN_READONLY if readonly else
+                 apsw.SQLITE_OPEN_READWRITE | apsw.SQLITE_OPEN_CREATE)
+        name = str(filename)
+        if options.immutable: # No locking and no checking for changes
+            name = pathlib.Path(filename).resolve().as_uri() + (
+                '?immutable=1')
+            flags |= apsw.SQLITE_OPEN_URI
+        self._db = apsw.Connection(name, flags=flags,
+                                   statementcachesize=STATEMENT_CACHE_SIZE)
+        self._db.setbusytimeout(TIMEOUT_LOCKED)
+        self._cursor = cursor = self._db.cursor()
+        if options.mmap_mb:
+            cursor.execute(
+                f'PRAGMA mmap_size = {options.mmap_mb * 2**20}').fetchall()
+        if options.cache_mb: # Negative means KB rather than pages
+            cursor.execute(
+                f'PRAGMA cache_size = -{options.cache_mb * 1024}')
+        if not readonly:
+            self._journal_mode = self._use_wal()
+
+
+    @property
+    def readonly(self):
+        return self._db is not None and self._db.readonly('main')
+
+
+    def _use_wal(self):
+        # In WAL mode readers don't block the writer and vice versa; returns
+        # the file's original journal mode if it was changed, else None
+        cursor = self._cursor
+        mode = Sql.first(cursor, 'PRAGMA journal_mode', Class=str)
+        if mode is None or mode.lower() in {'wal', 'memory', 'off'}:
+            return None
+        try:
+            wal = Sql.first(cursor, 'PRAGMA journal_mode = WAL', Class=str)
+        except apsw.Error:
+            return None # E.g., the file's directory isn't writable
+        return mode if wal is not None and wal.lower() == 'wal' else None
+
+
+    def reader(self):
+        # Lends a read-only connection for use in another thread (e.g., by
+        # a Worker); the borrower must give it back with release()
+        if self._db is not None:
+            if self._readers:
+                reader = self._readers.pop()
+                reader.refresh() # In case the schema has changed
+            else:
+                reader = Db(self._filename,
+                            options=self.options._replace(readonly=True))
+            if self.connection_pragmas:
+                reader.pragmas_save(Sql.Pragmas.unchanged(
+                    **self.connection_pragmas))
+            self._lent.add(reader)
+            return reader
+
+
+    def release(self, reader):
+        # Keeps the reader for reuse unless this Db has been closed or
+        # reopened since it was lent, or there are enough idle already
+        if reader in self._lent:
+            self._lent.discard(reader)
+            if len(self._readers) < READERS_MAX:
+                self._readers.append(reader)
+                return
+        reader.close()
+
+
+    def interrupt(self): # May be called from any thread
+        if self._db is not None:
+            self._db.interrupt()
 
 
     def close(self):
+        self._close_idle_readers()
+        self._lent.clear() # Lent readers are closed when released
+        self.connection_pragmas = {}
         if self._db is not None:
+            if self._journal_mode is not None:
+                self._restore_journal_mode()
             self._db.close()
             self._db = None
+            self._cursor = None
         self._filename = None
-        self.refresh()
+        self._schema = None
+        self._cache.clear()
+
+
+    def _close_idle_readers(self):
+        for reader in self._readers:
+            reader.close()
+        self._readers.clear()
+
+
+    def _restore_journal_mode(self):
+        # Only possible if no other connection has the file open
+        self._db.setbusytimeout(0)
+        try:
+            self._cursor.execute(
+                f'PRAGMA journal_mode = {self._journal_mode}').fetchall()
+        except apsw.Error:
+            pass # Leave it in WAL mode
+        self._journal_mode = None
 
 
     def refresh(self):
-        self.table_make_select.cache_clear()
-        self.view_make_select.cache_clear()
+        # Cheap unless the schema has changed (e.g., by another process)
+        # in which case only the cached results that depend on what
+        # changed are dropped; returns the lowercase names of the items
+        # that changed, or None if the schema hadn't been read before
+        if self._db is None or (old := self._schema) is None:
+            self._schema = None
+            self._cache.clear()
+            return None
+        version = Sql.first(self._cursor, 'PRAGMA schema_version')
+        if version == old.schema_version:
+            return set()
+        self._schema = None
+        changed = self.schema.changed(old)
+        for key, (depends_on, _) in list(self._cache.items()):
+            if depends_on is None or depends_on in changed:
+                del self._cache[key]
+        return changed
+
+
+    def data_version(self):
+        # Changes whenever another connection commits a change
+        if self._db is not None:
+            return Sql.first(self._cursor, 'PRAGMA data_version')
+
+
+    def statement_cache_stats(self):
+        # Returns the prepared statement cache's size, hits, misses, etc.,
+        # or None if this version of apsw doesn't provide them
+        if self._db is not None and (
+                cache_stats := getattr(self._db, 'cache_stats',
+                                       None)) is not None:
+            return cache_stats()
 
 
     @property
     def is_songbird(self):
         if self._db is not None:
-            cursor = self._db.cursor()
+            cursor = self._cursor
             with self._db:
                 return bool(Sql.first(cursor, Sql.IS_SONGBIRD, default=0))
         return False
 
 
+    @property
+    def schema(self): # A snapshot that's reused until refresh()
+        if self._schema is None:
+            self._schema = Schema(*self._schema_rows())
+        return self._schema
+
+
+    def _schema_rows(self): # Returns the rows and their schema_version
+        if self._db is None:
+            return (), None
+        cursor = self._cursor
+        with self._db: # So that the version matches the rows
+            version = Sql.first(cursor, 'PRAGMA schema_version')
+            try:
+                return cursor.execute(Sql.SCHEMA).fetchall(), version
+            except apsw.SQLError:
+                pass # E.g., a virtual table whose module isn't loaded
+            # Slow path: one query per table skipping any that fail
+            rows = []
+            for kind, name, table, sql in cursor.execute(
+                    Sql.SCHEMA_ITEMS).fetchall():
+                details = []
+                if kind == 'table':
+                    try:
+                        details = cursor.execute(
+                            Sql.ITEM_DETAIL, dict(name=name)).fetchall()
+                    except apsw.SQLError:
+                        pass
+                if not details:
+                    rows.append((kind, name, table, sql) + (None,) * 5)
+                for detail in details:
+                    rows.append((kind, name, table, sql) + detail[1:])
+            return rows, version
+
+
     def item_summary(self):
-        if self._db is not None:
-            cursor = self._db.cursor()
-            for row in cursor.execute(Sql.ITEM_SUMMARY):
-                item = Sql.ItemSummary(*row)
-                if item.name.startswith(('sqlite_', 'songbird_')):
-                    continue
-                # TODO also skip FTS implementation tables
-                yield item
+        for item in self.schema.items:
+            if item.name.startswith(('sqlite_', 'songbird_')):
+                continue
+            # TODO also skip FTS implementation tables
+            yield item
 
 
     def item_detail(self, name):
-        if self._db is not None:
-            cursor = self._db.cursor()
-            for row in cursor.execute(Sql.ITEM_DETAIL, dict(name=name)):
-                yield Sql.ItemDetail(*row[1:])
+        return self.schema.details(name)
 
 
     def pragmas(self):
         pragmas = Sql.Pragmas()
         if self._db is not None:
-            cursor = self._db.cursor()
-            with self._db:
-                pragmas.user_version = Sql.first(
-                    cursor, 'PRAGMA user_version', default=0)
+            cursor = self._cursor
+            for name in Sql.Pragmas.NAMES:
+                Class = str if name == 'journal_mode' else int
+                setattr(pragmas, name, Sql.first(cursor, f'PRAGMA {name}',
+                                                 Class=Class))
         return pragmas
 
 
     def pragmas_save(self, pragmas):
+        # Not in a transaction since some pragmas can't be set in one;
+        # connection pragmas are remembered to apply to any readers
         errors = []
         if self._db is not None:
-            cursor = self._db.cursor()
-            with self._db:
-                if pragmas.user_version is not UNCHANGED:
-                    try:
-                        cursor.execute(
-                            f'PRAGMA user_version = {pragmas.user_version}')
-                    except apsw.SQLError as err:
-                        errors.append(str(err))
+            cursor = self._cursor
+            for name in Sql.Pragmas.NAMES:
+                if (value := getattr(pragmas, name)) is UNCHANGED:
+                    continue
+                if name == 'journal_mode':
+                    self._close_idle_readers() # Else can't leave WAL mode
+                try:
+                    sql = f'PRAGMA {name} = {Sql.pragma_value(name, value)}'
+                    result = Sql.first(cursor, sql, Class=str)
+                except (apsw.Error, Sql.Error) as err:
+                    errors.append(f'{name}: {err}')
+                    continue
+                if name == 'journal_mode':
+                    if result is not None and (
+                            result.lower() != value.lower()):
+                        errors.append(f'{name}: is still {result}')
+                    else:
+                        self._journal_mode = None # Don't restore on close
+                elif name in Sql.Pragmas.CONNECTION:
+                    self.connection_pragmas[name] = value
         return errors
 
 
@@ -107,16 +339,67 @@ class Db:
         # return self.query_make_select(name) # TODO
 
 
-    def select_row_count(self, select):
+    def select_row_count(self, select, bindings=None):
+        # Only select's first statement is counted (see select_cursor())
         if self._db is not None:
-            sql = f'SELECT COUNT(*) FROM ({Sql.uncommented(select)})'
-            cursor = self._db.cursor()
+            sql, limit, offset = Sql.select_limit_parts(select)
+            sql = f'SELECT COUNT(*) FROM ({sql})'
+            cursor = self._cursor
             with self._db:
-                return Sql.first(cursor, sql, default=0)
+                return Sql.first(cursor, sql, dict(
+                    bindings or (), offset=offset,
+                    limit=-1 if limit is None else limit), default=0)
         return 0
 
 
-    @functools.lru_cache
+    def select_row_estimate(self, select):
+        # Returns a quick estimate of a plain table's row count (from
+        # ANALYZE's statistics or the rowid range), or None for others
+        if self._db is None or (
+                parts := Sql.simple_select_parts(select)) is None or (
+                parts[2] is not None): # Can't estimate what WHERE matches
+            return None
+        name = parts[1].strip('"')
+        cursor = self._cursor
+        with self._db:
+            try:
+                if stat := Sql.first(cursor, Sql.STAT1_ROWS,
+                                     dict(name=name), Class=str):
+                    return int(stat.split()[0])
+            except apsw.SQLError:
+                pass # No sqlite_stat1 table (i.e., never analyzed)
+        if self.rowid_table(select) is not None:
+            low, high = self.rowid_range(name)
+            return 0 if low is None else high - low + 1
+        return None
+
+
+    @_schema_cached(_select_table)
+    def select_sort_indexed(self, select):
+        # Returns False if SQLite must sort select's rows itself, i.e.,
+        # if no index (or the rowid) supports its ORDER BY; only select's
+        # first statement is explained since apsw would run them all
+        if self._db is not None:
+            cursor = self._cursor
+            sql = f'EXPLAIN QUERY PLAN {Sql.parsed(select).head}'
+            with self._db: # fetchall() so the statement is finished
+                return not any('USE TEMP B-TREE' in row[-1]
+                               for row in cursor.execute(sql).fetchall())
+        return True
+
+
+    def select_cursor(self, select, bindings=None):
+        # The caller must close() the cursor; only select's first statement
+        # is run (with its LIMIT and OFFSET if any; -1 means no limit)
+        if self._db is not None:
+            sql, limit, offset = Sql.select_limit_parts(select)
+            cursor = self._db.cursor()
+            cursor.execute(sql, dict(bindings or (), offset=offset,
+                                     limit=-1 if limit is None else limit))
+            return cursor
+
+
+    @_schema_cached(str.lower)
     def table_make_select(self, name):
         fields = []
         for detail in self.item_detail(name):
@@ -126,35 +409,112 @@ class Db:
                 '--WHERE \n--ORDER BY ')
 
 
-    def table_row(self, select, row): # Rely on SQLite to cache
+    def table_rows(self, select, offset, count, bindings=None):
         if self._db is not None:
-            select = Sql.select_limit_1_from_select(select, row)
-            cursor = self._db.cursor()
+            select, limits = Sql.select_limit_from_select(select, offset,
+                                                          count)
+            cursor = self._cursor
             with self._db:
-                return cursor.execute(select).fetchone()
+                return cursor.execute(select, dict(bindings or (),
+                                                   **limits)).fetchall()
+        return []
+
+
+    @_schema_cached(_select_table)
+    def rowid_table(self, select):
+        # Returns the name of the rowid table select reads if select can
+        # use keyset (seek) pagination; otherwise returns None
+        if self._db is None or (
+                parts := Sql.simple_select_parts(select)) is None:
+            return None
+        name = parts[1].strip('"')
+        if (item := self.schema.kind(name)) is None:
+            return None
+        if item.kind != 'table' or re.search(
+                r'^\s*CREATE\s+VIRTUAL\s|\)[\s\w,]*\bWITHOUT\s+ROWID\b',
+                item.sql, re.IGNORECASE):
+            return None
+        for detail in self.item_detail(name):
+            if detail.name.lower() == 'rowid': # Shadows the real rowid
+                return None
+        return name
 
 
-    @functools.lru_cache
-    def view_make_select(self, name):
+    def rowid_range(self, table):
         if self._db is not None:
-            cursor = self._db.cursor()
+            cursor = self._cursor
+            sql = f'SELECT MIN(rowid), MAX(rowid) FROM {Sql.quoted(table)}'
             with self._db:
-                sql = Sql.first(cursor, Sql.TABLE_OR_VIEW_SQL,
-                                dict(name=name), Class=str)
-                return re.sub(r'\s+(from|where|order\s+by)\s', r'\n\1 ',
-                              Sql.select_from_create_view(sql),
-                              flags=re.IGNORECASE | re.DOTALL)
+                return cursor.execute(sql).fetchall()[0]
+        return None, None
 
 
-    def field_names_for_select(self, select):
-        # Usually try Sql.field_names_from_select() first
+    def table_rows_seek(self, select, rowid, offset, count, *,
+                        descending=False, bindings=None):
+        # select must be one for which rowid_table() returns a name; each
+        # row has its rowid prepended and big BLOB and TEXT values are
+        # returned as Sql.Lazy values (see value_save())
         if self._db is not None:
-            select = Sql.select_limit_1_from_select(select)
-            cursor = self._db.cursor()
+            fields, table, where = Sql.simple_select_parts(select)
+            sql = Sql.select_seek_from_parts(fields, table, where,
+                                             descending=descending)
+            bindings = dict(bindings or (), rowid=rowid, offset=offset,
+                            count=count, lazy=LAZY_SIZE, prefix=LAZY_PREFIX)
+            cursor = self._cursor
             with self._db:
-                try:
-                    cursor.execute(select)
-                    return [Sql.quoted(item[0])
-                            for item in cursor.getdescription()]
-                except (apsw.SQLError, apsw.ExecutionCompleteError):
-                    return () # No matching rows
+                return [Sql.lazy_row(fields, table, row)
+                        for row in cursor.execute(sql, bindings)]
+        return []
+
+
+    def value_save(self, lazy, filename):
+        # Writes the whole of a Sql.Lazy value a chunk at a time
+        if self._db is not None:
+            with self._db.blobopen('main', lazy.table, lazy.column,
+                                   lazy.rowid, False) as blob:
+                with open(filename, 'wb') as file:
+                    while chunk := blob.read(BLOB_CHUNK):
+                        file.write(chunk)
+
+
+    @_schema_cached(str.lower)
+    def view_make_select(self, name):
+        if (item := self.schema.kind(name)) is not None:
+            return re.sub(r'\s+(from|where|order\s+by)\s', r'\n\1 ',
+                          Sql.select_from_create_view(item.sql),
+                          flags=re.IGNORECASE | re.DOTALL)
+
+
+    def field_names_for_select(self, select):
+        # Usually try Sql.field_names_from_select() first
+        return [Sql.quoted(column.name)
+                for column in self.select_columns(select)]
+
+
+    def select_columns(self, select):
+        # Returns select's result columns as Sql.Column(name, type) tuples
+        # (type is the declared type or None) without running select; they
+        # are cached per select without its comments, LIMIT, or ;
+        return self._select_columns(Sql.parsed(select).head)
+
+
+    @_schema_cached(_select_table)
+    def _select_columns(self, select):
+        if self._db is None:
+            return ()
+        return _prepare(self._db, select)
+
+
+    def sql_error(self, sql):
+        # Returns None if sql's first statement can be prepared (it isn't
+        # run) or a Sql.Invalid with the error and where it is in sql
+        if self._db is None:
+            return None
+        try:
+            _prepare(self._db, sql)
+        except apsw.Error as err:
+            position = None
+            if (offset := getattr(err, 'error_offset', -1)) >= 0:
+                position = len(sql.encode()[:offset].decode(
+                    errors='ignore'))
+            return Sql.Invalid(str(err), position)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+import collections
+
+from . import Sql
+
+
+class Schema:
+
+    # A snapshot of the database's items (tables, views, indexes, and
+    # triggers) and of every table's columns as of schema_version; rows
+    # are those returned by Sql.SCHEMA, i.e., one per column with the
+    # item repeated for each (or just the item with None for the column
+    # for non-tables)
+    def __init__(self, rows=(), schema_version=None):
+        self.schema_version = schema_version
+        self.items = [] # Sql.ItemSummary's in Sql.SCHEMA order
+        self._kinds = {} # name.lower() → Sql.ItemKind
+        self._tables = {} # name.lower() → table it belongs to .lower()
+        self._details = collections.defaultdict(list) # as for _kinds
+        for kind, name, table, sql, *detail in rows:
+            key = name.lower()
+            if key not in self._kinds:
+                self.items.append(Sql.ItemSummary(kind, name))
+                self._kinds[key] = Sql.ItemKind(kind, sql)
+                self._tables[key] = table.lower()
+            if detail[0] is not None:
+                self._details[key].append(Sql.ItemDetail(*detail))
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    def kind(self, name): # Returns None if there's no such item
+        return self._kinds.get(name.lower())
+
+
+    def details(self, name): # The columns of table name (if any)
+        return tuple(self._details.get(name.lower(), ()))
+
+
+    def changed(self, old):
+        # Returns the lowercase names of the items that have been added,
+        # dropped or altered since the old snapshot and of the tables
+        # they belong to (e.g., an index's table)
+        changed = set()
+        for key in self._kinds.keys() | old._kinds.keys():
+            if (self._kinds.get(key) != old._kinds.get(key) or
+                    self._details.get(key) != old._details.get(key)):
+                changed.add(key)
+                for schema in (self, old):
+                    if (table := schema._tables.get(key)) is not None:
+                        changed.add(table)
+        return changed
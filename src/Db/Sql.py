@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 # Copyright © 2020 Mark Summerfield. All rights reserved.
 
+import bisect
 import collections
 import functools
+import itertools
 import re
 
 try:
@@ -17,20 +19,41 @@ class Error(Exception):
 
 class Pragmas:
 
-    def __init__(self, *, user_version=0):
+    # The connection pragmas only last as long as the connection so must
+    # be set again whenever the database is opened; the others are stored
+    # in the database itself
+    CONNECTION = ('cache_size', 'mmap_size', 'synchronous', 'temp_store',
+                  'wal_autocheckpoint', 'threads')
+    NAMES = ('user_version', 'journal_mode', 'page_size') + CONNECTION
+
+    def __init__(self, *, user_version=0, journal_mode='delete',
+                 page_size=4096, cache_size=-2000, mmap_size=0,
+                 synchronous=2, temp_store=0, wal_autocheckpoint=1000,
+                 threads=0):
         self.user_version = user_version
+        self.journal_mode = journal_mode
+        self.page_size = page_size
+        self.cache_size = cache_size # Negative means KB rather than pages
+        self.mmap_size = mmap_size # bytes
+        self.synchronous = synchronous # 0 OFF 1 NORMAL 2 FULL 3 EXTRA
+        self.temp_store = temp_store # 0 DEFAULT 1 FILE 2 MEMORY
+        self.wal_autocheckpoint = wal_autocheckpoint # pages
+        self.threads = threads
 
 
     @staticmethod
-    def unchanged():
-        return Pragmas(user_version=UNCHANGED)
+    def unchanged(**kwargs): # Only those given are changed
+        return Pragmas(**{**dict.fromkeys(Pragmas.NAMES, UNCHANGED),
+                          **kwargs})
 
 
 def first(cursor, sql, d=None, *, default=None, Class=int):
     d = {} if d is None else d
-    if (record := cursor.execute(sql, d).fetchone()) is None:
+    # fetchall() so that the statement is finished (a statement that
+    # isn't keeps its read transaction open)
+    if not (records := cursor.execute(sql, d).fetchall()):
         return default # Deliberately ignores Class
-    if (value := record[0]) is None:
+    if (value := records[0][0]) is None:
         return value
     return bool(int(value)) if isinstance(Class, bool) else Class(value)
 
@@ -42,32 +65,567 @@ def quoted(name, *, quote='"', force=False):
             not re.fullmatch(r'\w+', name) else name)
 
 
+# Splits SQL into tokens in one pass: comments, strings, quoted names
+# (which may be unterminated, e.g., while being typed, and then run to
+# the end), words, numbers, parameters, and punctuation; each match
+# starts with any whitespace and the last is just trailing whitespace
+TOKEN_RX = re.compile(r'''\s*(?:
+(?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+|(?P<string>[xX]?'[^']*(?:''[^']*)*'?)
+|(?P<name>"[^"]*(?:""[^"]*)*"?|`[^`]*(?:``[^`]*)*`?|\[[^\]]*\]?)
+|(?P<word>[^\W\d]\w*)
+|(?P<number>0[xX][\da-fA-F]+|(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+|(?P<param>[?:@$]\w*)
+|(?P<punct>->>|->|\|\||<<|>>|<=|>=|==|!=|<>|.))?''',
+                      re.VERBOSE | re.DOTALL)
+
+# The keywords that start a top-level clause (ORDER and GROUP take the BY
+# that follows them)
+CLAUSES = frozenset({'SELECT', 'FROM', 'WHERE', 'GROUP', 'HAVING',
+                     'ORDER', 'LIMIT', 'UNION', 'EXCEPT', 'INTERSECT',
+                     'VALUES'})
+
+# kind is one of TOKEN_RX's group names; start is the offset in the SQL
+# without its comments (see parsed()) and origin the offset in the SQL
+Token = collections.namedtuple('Token', ('kind', 'text', 'start',
+                                         'origin'))
+
+# at is the offset of a clause's keyword, and start and end those of its
+# first token after the keyword (and BY) and just past its last token,
+# in the SQL without its comments (see parsed()); start is end if the
+# clause has no tokens
+Clause = collections.namedtuple('Clause', ('keyword', 'at', 'start',
+                                           'end'))
+
+# What can hide SQL inside it (see TOKEN_RX); parsed() blanks these out so
+# that it can find a statement's structure with str methods rather than
+# by tokenizing all of it
+QUOTED_RX = re.compile(r'''(--[^\n]*|/\*.*?(?:\*/|\Z)
+|'[^']*(?:''[^']*)*'?|"[^"]*(?:""[^"]*)*"?|`[^`]*(?:``[^`]*)*`?
+|\[[^\]]*\]?)''', re.VERBOSE | re.DOTALL)
+LEADING_RX = re.compile(r'(?:\s+|--[^\n]*|/\*.*?(?:\*/|\Z))*', re.DOTALL)
+# These are only used on masked SQL (see parsed()) where ? may stand for
+# any non-ASCII character (and so part of a word); CLAUSE_RX matches a
+# clause's keyword (with any BY) and the whitespace after it and
+# parsed() checks those followed by a ? since it may be a parameter
+CLAUSE_RX = re.compile('({})'.format('|'.join(
+    rf'{word}(?<![\w?:@$]{word})(?!\w)' + (
+        r'(?:\s*BY(?![\w?]))?' if word in {'GROUP', 'ORDER'} else '')
+    for word in sorted(CLAUSES))) + r'(\s*)', re.ASCII)
+ALL_RX = re.compile(r'(?:ALL|DISTINCT)(?![\w?])\s*', re.ASCII)
+# A result column and its alias (which follows its last AS that has
+# something after it)
+FIELD_RX = re.compile(r'''([^,]*(?<![\w?:@$])AS(?![\w?])(\s*[^\s,][^,]*)
+|[^,]*)(,|\Z)''', re.VERBOSE | re.ASCII)
+LIMIT_RX = re.compile(r'(\d+)(?:(\s+OFFSET\s+|\s*,\s*)(\d+))?',
+                      re.IGNORECASE)
+
+
+class Statement(collections.namedtuple(
+        'Statement', ('sql', 'kind', 'clauses', 'limit', 'offset',
+                      'head', 'end', 'masked', 'cuts'))):
+
+    # See parsed()
+    __slots__ = ()
+
+    def tokens(self, clause): # Returns the clause's Tokens
+        return _tokens(self.sql, clause.start, clause.end, self.cuts)
+
+
+    def origin(self, start): # Returns start's offset in the original SQL
+        return _origin(self.cuts, start)
+
+
 @functools.lru_cache
+def parsed(sql):
+    # Returns sql's Statement: sql without comments (a /* */ comment
+    # between tokens becomes a space) or surrounding whitespace; kind is
+    # its uppercased first keyword (e.g., 'SELECT' or ''); clauses are the
+    # Clauses of its top-level clauses up to any ; (subqueries are inside
+    # them); limit (or None) and offset are its final numeric LIMIT and
+    # OFFSET, and head is sql without these or any ; and what follows it;
+    # end is the offset of the ; (or None); masked is sql uppercased with
+    # its strings and quoted names blanked out (and its non-ASCII
+    # characters replaced by ? since some uppercase to more than one
+    # character), and cuts map offsets in sql to those in the original
+    # (see Statement.origin()). Only the keywords that matter are looked
+    # at so that a huge SELECT is parsed in about the time a couple of
+    # regexes take to search it; Statement.tokens() tokenizes a clause if
+    # need be
+    sql, upper, cuts = _uncommented(sql)
+    end = None
+    i = upper.find(';')
+    while i != -1:
+        if not _depth(upper[:i]):
+            end = i
+            break
+        i = upper.find(';', i + 1)
+    head = sql if end is None else sql[:end].rstrip()
+    # Code, keyword, whitespace after it, code, ..., code
+    pieces = CLAUSE_RX.split(upper[:len(head)])
+    clauses = []
+    keyword = start = begin = None
+    code = pieces[0]
+    at = len(code)
+    depth = _depth(code)
+    for i in range(1, len(pieces), 3):
+        text = pieces[i]
+        after = at + len(text)
+        if not depth and (pieces[i + 1] or # Followed by whitespace
+                          not upper.startswith('?', after) or
+                          sql[after] == '?') and (
+                text != 'FROM' or # Not IS [NOT] DISTINCT FROM
+                not _after_word(upper, sql, at, 'DISTINCT')):
+            if keyword is not None:
+                until = at - len(code) + len(code.rstrip())
+                clauses.append(Clause(keyword, start, begin, until))
+            keyword = text if text in CLAUSES else text[:5] # ORDER BY
+            start = at
+            begin = after + len(pieces[i + 1])
+        code = pieces[i + 2]
+        if depth or '(' in code or ')' in code:
+            depth = _depth(code, depth)
+        at = after + len(pieces[i + 1]) + len(code)
+    if keyword is not None:
+        clauses.append(Clause(keyword, start, begin, len(head)))
+    match = TOKEN_RX.match(sql)
+    kind = match.group('word').upper() if match.lastgroup == 'word' else ''
+    limit = None
+    offset = 0
+    if clauses and (clause := clauses[-1]).keyword == 'LIMIT' and (
+            match := LIMIT_RX.fullmatch(sql, clause.start, clause.end)):
+        limit, separator, other = match.groups()
+        limit, offset = int(limit), int(other or 0)
+        if separator and separator.strip() == ',': # LIMIT offset, limit
+            limit, offset = offset, limit
+        head = sql[:clause.at].rstrip()
+    return Statement(sql, kind, tuple(clauses), limit, offset, head, end,
+                     upper, cuts)
+
+
+def _uncommented(sql):
+    # Returns sql without comments (see parsed()), the same masked (with
+    # each character of its strings and quoted names replaced by NUL),
+    # and the cuts for Statement.origin(): offsets in sql without
+    # comments, and how many characters were dropped before each
+    lead = LEADING_RX.match(sql).end() if sql[:1].isspace() or (
+        sql.startswith(('--', '/*'))) else 0
+    pieces = QUOTED_RX.split(sql[lead:]) # Code, quoted, code, ..., code
+    masks = pieces.copy()
+    masks[1::2] = map('\0'.__mul__, map(len, pieces[1::2]))
+    offsets = [0]
+    dropped = [lead]
+    if '--' in sql or '/*' in sql: # May have comments
+        starts = list(itertools.accumulate(map(len, pieces), initial=lead))
+        for i in range(1, len(pieces), 2):
+            if (text := pieces[i])[0] in '-/': # A comment
+                start = starts[i]
+                space = ' ' if text.startswith('/*') and (
+                    not sql[start - 1].isspace()) else ''
+                pieces[i] = masks[i] = space
+                dropped.append(dropped[-1] + len(text) - len(space))
+                offsets.append(starts[i + 1] - dropped[-1])
+    sql = ''.join(pieces).rstrip()
+    return sql, ''.join(masks)[:len(sql)].encode('ascii', 'replace').upper(
+        ).decode('ascii'), (offsets, dropped)
+
+
+def _depth(text, depth=0):
+    # Returns the parentheses' nesting depth after text given the depth
+    # before it
+    if '(' in text and ')' in text:
+        for c in re.findall(r'[()]', text):
+            depth = depth + 1 if c == '(' else max(0, depth - 1)
+        return depth
+    return max(0, depth + text.count('(') - text.count(')'))
+
+
+def _is_word(sql, i, size):
+    # Returns True if sql[i:i + size] (which is outside any string or
+    # quoted name) isn't part of a longer word or a parameter's name
+    return not ((i and ((c := sql[i - 1]).isalnum() or c in '_?:@$')) or
+                ((c := sql[i + size:i + size + 1]).isalnum() or c == '_'))
+
+
+def _after_word(upper, sql, i, word): # Is the word before i word?
+    j = upper.rfind(word, 0, i)
+    return j != -1 and not upper[j + len(word):i].strip() and _is_word(
+        sql, j, len(word))
+
+
+def _tokens(sql, start, end, cuts):
+    # Returns the Tokens in sql (which has no comments) from start to end
+    tokens = []
+    for match in TOKEN_RX.finditer(sql, start, end):
+        if (kind := match.lastgroup) is not None:
+            offset = match.start(kind)
+            tokens.append(Token(kind, match.group(kind), offset,
+                                _origin(cuts, offset)))
+    return tuple(tokens)
+
+
+def _origin(cuts, start): # See _uncommented()
+    offsets, dropped = cuts
+    return start + dropped[bisect.bisect_right(offsets, start) - 1]
+
+
+def _result_columns(statement):
+    # Returns a (text, alias) pair for each of the result columns of the
+    # statement's first top-level SELECT where alias is what follows the
+    # column's last top-level AS that has something after it (or None)
+    for clause in statement.clauses:
+        if clause.keyword == 'SELECT':
+            break
+    else:
+        return []
+    if clause.start == clause.end:
+        return []
+    sql = statement.sql
+    start = clause.start
+    if match := ALL_RX.match(statement.masked, start, clause.end):
+        start = match.end()
+    text = statement.masked[start:clause.end]
+    if '(' in text or ')' in text: # Only top-level commas and ASes count
+        text = _flattened(text)
+    fields = []
+    for field, alias, comma in FIELD_RX.findall(text)[
+            :text.count(',') + 1]:
+        end = start + len(field)
+        alias = sql[end - len(alias):end].strip() if alias else None
+        fields.append((sql[start:end].strip(), alias))
+        start = end + len(comma)
+    return fields
+
+
+def _flattened(text): # Returns text with what's in parentheses blanked
+    pieces = []
+    depth = done = 0
+    for match in re.finditer(r'[()]', text):
+        i = match.start()
+        if match.group() == '(':
+            if not depth:
+                pieces.append(text[done:i + 1])
+                done = i + 1
+            depth += 1
+        elif depth:
+            depth -= 1
+            if not depth:
+                pieces.append('\0' * (i - done))
+                done = i
+    pieces.append('\0' * (len(text) - done) if depth else text[done:])
+    return ''.join(pieces)
+
+
+def _unquoted(text): # text is a name or string token's text
+    if text.startswith('['):
+        return text[1:].rstrip(']')
+    if (quote := text[0]) not in {'"', "'", '`'}:
+        return text # A BLOB, e.g., x'00'
+    text = text[1:-1] if len(text) > 1 and text.endswith(quote) else (
+        text[1:])
+    return text.replace(quote * 2, quote)
+
+
 def uncommented(sql):
-    # Simple-minded, e.g., incorrect if -- or /* is inside a string etc.
-    return re.sub(r'/\*.*?\*/', '', re.sub(r'--.*', '', sql),
-                  flags=re.DOTALL).strip()
+    return parsed(sql).sql
 
 
-@functools.lru_cache
 def is_select(sql):
-    return re.match(r'\s*SELECT\s', uncommented(sql),
-                    re.IGNORECASE) is not None
+    return parsed(sql).kind == 'SELECT'
+
+
+def from_tables(sql):
+    # Returns the names of the tables and views that sql's top-level FROM
+    # clauses (including their JOINs) read
+    names = []
+    statement = parsed(sql)
+    for clause in statement.clauses:
+        if clause.keyword != 'FROM':
+            continue
+        depth = 0
+        expect = True # The next name is a table's
+        named = False # The previous token was a table's name
+        for token in statement.tokens(clause):
+            if token.text == '.' and named:
+                names.pop() # It was a schema's name
+                expect = True
+            elif token.text == '(':
+                depth += 1
+                expect = False # A subquery or table-valued function
+            elif token.text == ')':
+                depth = max(0, depth - 1)
+            elif depth:
+                pass
+            elif token.text == ',' or token.text.upper() == 'JOIN':
+                expect = True
+            elif expect and token.kind in {'word', 'name'}:
+                names.append(token.text if token.kind == 'word' else
+                             _unquoted(token.text))
+                expect = False
+                named = True
+                continue
+            named = False
+    return names
+
+
+def select_limit_from_select(select, offset=0, limit=1):
+    # Returns (sql, bindings) where sql is select with LIMIT :limit
+    # OFFSET :offset so that the same prepared statement can be reused
+    # for every offset and limit
+    sql, original_limit, original_offset = select_limit_parts(select)
+    if original_limit is not None:
+        limit = max(0, min(limit, original_limit - offset))
+    return sql, dict(limit=limit, offset=offset + original_offset)
+
+
+@functools.lru_cache
+def select_limit_parts(select):
+    # Returns (sql, limit, offset) where sql is select with its LIMIT and
+    # OFFSET (if any) replaced by parameters and limit (or None) and
+    # offset are select's original values
+    statement = parsed(select)
+    head = statement.head
+    if statement.limit is None and statement.clauses and (
+            statement.clauses[-1].keyword == 'LIMIT'): # Not a number
+        head = f'SELECT * FROM ({head})'
+    return head + ' LIMIT :limit OFFSET :offset', statement.limit, (
+        statement.offset)
 
 
 @functools.lru_cache
-def select_limit_1_from_select(select, row=0):
-    select = uncommented(select)
-    limit_rx = re.compile(
-        r'\sLIMIT\s+\d+(:?\s+OFFSET\s+(?P<offset>\d+))?',
-        re.IGNORECASE | re.DOTALL)
-    if match := limit_rx.search(select):
-        if offset := match.group('offset'):
-            row += int(offset)
-        select = limit_rx.sub(' LIMIT 1', select)
-    else: # No original limit set
-        select = select.rstrip(';') + ' LIMIT 1'
-    return select + f' OFFSET {row}'
+def simple_select_parts(select):
+    # Returns (fields, table, where) if select is just SELECT fields FROM
+    # table with an optional WHERE (where is None if there isn't one)
+    statement = parsed(select)
+    if statement.kind != 'SELECT' or [
+            clause.keyword for clause in statement.clauses] not in (
+                ['SELECT', 'FROM'], ['SELECT', 'FROM', 'WHERE']):
+        return None
+    fields, table, *where = statement.clauses
+    masked = statement.masked[fields.start:fields.end] # No strings or names
+    if not masked or ALL_RX.match(masked) or any(
+            c in masked for c in '()*'):
+        return None
+    table = statement.tokens(table)
+    if len(table) != 1 or not (table[0].kind == 'word' or (
+            table[0].text.startswith('"') and len(table[0].text) > 2 and
+            table[0].text.endswith('"'))):
+        return None
+    if where:
+        where = where[0]
+        if where.start == where.end or any(
+                token.kind == 'word' and token.text.upper() in {
+                    'SELECT', 'WINDOW'}
+                for token in statement.tokens(where)):
+            return None
+        where = statement.sql[where.start:where.end]
+    else:
+        where = None
+    return statement.sql[fields.start:fields.end], table[0].text, where
+
+
+@functools.lru_cache
+def select_seek_from_parts(fields, table, where=None, *, descending=False):
+    # Column values longer than :lazy bytes (BLOBs) or characters (TEXT)
+    # are returned as NULL (BLOB) or their first :prefix characters
+    # (TEXT); the last field says which values these are as a string of
+    # "field type length," entries (see lazy_row())
+    op, order = ('<', 'DESC') if descending else ('>=', 'ASC')
+    columns = []
+    lazy = []
+    for i, field in enumerate(split_fields(fields)):
+        if column_name(field) is None: # Not a plain column
+            columns.append(field)
+            continue
+        big = f'length({field}) > :lazy'
+        columns.append(f'CASE WHEN {big} THEN CASE WHEN typeof({field}) = '
+                       f"'text' THEN substr({field}, 1, :prefix) END "
+                       f'ELSE {field} END')
+        lazy.append(f"CASE WHEN {big} THEN '{i} ' || typeof({field}) || "
+                    f"' ' || length({field}) || ',' ELSE '' END")
+    columns = ', '.join(columns)
+    lazy = ' || '.join(lazy) or "''"
+    where = '' if where is None else f'({where}) AND '
+    return (f'SELECT rowid, {columns}, {lazy} FROM {table} WHERE {where}'
+            f'rowid {op} :rowid ORDER BY rowid {order} LIMIT :count '
+            'OFFSET :offset;')
+
+
+@functools.lru_cache
+def split_fields(fields): # fields must not contain parentheses
+    return tuple(field.strip() for field in re.findall(
+        r'''(?:"(?:[^"]|"")*"|'(?:[^']|'')*'|[^,"']+)+''', fields))
+
+
+def column_name(field): # Returns None if field isn't a column name
+    if re.fullmatch(r'"(?:[^"]|"")+"', field):
+        return field[1:-1].replace('""', '"')
+    if re.fullmatch(r'[A-Za-z_]\w*', field):
+        return field
+
+
+def lazy_row(fields, table, row):
+    # row is (rowid, *values, lazy) from a select_seek_from_parts()
+    # select; returns [rowid, *values] with any values that were too big
+    # to fetch replaced by Lazy values
+    *row, lazy = row
+    if lazy:
+        fields = split_fields(fields)
+        for entry in lazy.rstrip(',').split(','):
+            i, kind, size = entry.split()
+            i = int(i) + 1 # Skip the rowid
+            row[i] = Lazy(column_name(table), column_name(fields[i - 1]),
+                          row[0], kind, int(size), row[i])
+    return row
+
+
+class Lazy(collections.namedtuple(
+        'Lazy', ('table', 'column', 'rowid', 'kind', 'size', 'prefix'))):
+
+    __slots__ = ()
+
+    def __str__(self):
+        if self.kind == 'text':
+            return f'{self.prefix}… <TEXT {human_size(self.size)}>'
+        return f'<{self.kind.upper()} {human_size(self.size)}>'
+
+
+def human_size(size):
+    for limit, suffix in ((2**30, 'GB'), (2**20, 'MB'), (2**10, 'KB')):
+        if size >= limit:
+            return f'{size / limit:.1f} {suffix}'
+    return f'{size:,} B'
+
+
+@functools.lru_cache
+def select_where(select, where):
+    # Returns select restricted to the rows that match where, which must
+    # only refer to select's field names; where is spliced into a simple
+    # select (see simple_select_parts()) with an optional ORDER BY, and
+    # any other select becomes a subquery
+    statement = parsed(select)
+    select = statement.sql
+    if statement.end is not None: # Drop the ; and what follows it
+        select = select[:statement.end].rstrip()
+    keywords = [clause.keyword for clause in statement.clauses]
+    end = len(select) # Where the WHERE (or just the SELECT) ends
+    if keywords[-1:] == ['ORDER']:
+        end = statement.clauses[-1].at
+    if (parts := simple_select_parts(select[:end])) is not None and all(
+            column_name(field) is not None
+            for field in split_fields(parts[0])):
+        if parts[2] is None:
+            head, order = select[:end].rstrip(), select[end:]
+            return f'{head} WHERE {where} {order}'.rstrip()
+        start, end = statement.clauses[keywords.index('WHERE')][2:]
+        return (f'{select[:start]}({select[start:end]}) AND {where}'
+                f'{select[end:]}')
+    return f'SELECT * FROM ({select}) WHERE {where}'
+
+
+def filter_where(filters):
+    # filters is a sequence of (field name, text) pairs where text is
+    # NULL, !NULL, an operator (=, !=, <>, <, <=, >, >=) followed by a
+    # value, or text to search for; returns (where, bindings) where
+    # where uses :f0, :f1, ... parameters (or is None if there are no
+    # filters) and bindings is a tuple of (parameter, value) pairs
+    conditions = []
+    bindings = []
+    for name, text in filters:
+        if not (text := text.strip()):
+            continue
+        field = quoted(name, force=True)
+        if text.upper() in {'NULL', '!NULL'}:
+            not_ = 'NOT ' if text.startswith('!') else ''
+            conditions.append(f'{field} IS {not_}NULL')
+            continue
+        param = f'f{len(bindings)}'
+        if match := re.match(r'(<=|>=|<>|!=|=|<|>)\s*', text):
+            conditions.append(f'{field} {match.group(1)} :{param}')
+            value = number(text[match.end():])
+        else:
+            conditions.append(f"{field} LIKE :{param} ESCAPE '\\'")
+            value = '%' + re.sub(r'([\\%_])', r'\\\1', text) + '%'
+        bindings.append((param, value))
+    return ' AND '.join(conditions) or None, tuple(bindings)
+
+
+def number(text): # Returns text as an int or float if it is one
+    for Class in (int, float):
+        try:
+            return Class(text)
+        except ValueError:
+            pass
+    return text
+
+
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+
+
+def pragma_value(name, value): # Returns value as safe PRAGMA SQL
+    if name == 'journal_mode':
+        if (value := str(value).lower()) not in JOURNAL_MODES:
+            raise Error(f'invalid journal mode: {value}')
+        return value
+    try:
+        return str(int(value))
+    except (TypeError, ValueError):
+        raise Error(f'invalid {name}: {value}')
+
+
+# bindings is a tuple of (parameter, value) pairs so that a Query can be
+# used as a key
+Query = collections.namedtuple('Query', ('select', 'bindings'))
+
+# immutable implies readonly; mmap_mb and cache_mb are only set if nonzero
+OpenOptions = collections.namedtuple(
+    'OpenOptions', ('readonly', 'immutable', 'mmap_mb', 'cache_mb'),
+    defaults=(False, False, 0, 0))
+
+
+def select_order_by(sql, order):
+    # Adds or replaces sql's final top-level ORDER BY keeping its comments
+    # apart from any "--ORDER BY" placeholder
+    for match in reversed([
+            match for match in TOKEN_RX.finditer(sql)
+            if match.lastgroup == 'comment' and re.match(
+                r'--\s*ORDER\s+BY\b', match.group('comment'),
+                re.IGNORECASE)]):
+        sql = sql[:match.start()] + sql[match.end():]
+    statement = parsed(sql)
+    clauses = statement.clauses
+    end = len(sql) if statement.end is None else statement.origin(
+        statement.end)
+    limit = None # The index of the final LIMIT clause
+    if clauses and clauses[-1].keyword == 'LIMIT':
+        limit = len(clauses) - 1
+        end = statement.origin(clauses[limit].at)
+    start = end
+    if (i := len(clauses) - 1 - (limit is not None)) >= 0 and (
+            clauses[i].keyword == 'ORDER'):
+        start = statement.origin(clauses[i].at)
+        if limit is None and (clause := clauses[i]).start < clause.end:
+            end = statement.origin(clause.end - 1) + 1
+    tail = sql[end:] if limit is None else ' ' + sql[end:]
+    return f'{sql[:start].rstrip()}\nORDER BY {order}{tail}'
+
+
+def same_rows(select, other):
+    # Returns True if select and other can only differ in the order of
+    # their rows, i.e., at most in their final top-level ORDER BY (which
+    # isn't followed by a LIMIT), comments, and whitespace
+    return _unordered(select) == _unordered(other)
+
+
+@functools.lru_cache
+def _unordered(select):
+    statement = parsed(select)
+    clauses = statement.clauses
+    if clauses and clauses[-1].keyword == 'ORDER':
+        clauses = clauses[:-1]
+    return tuple((clause.keyword, tuple(
+        token.text for token in statement.tokens(clause)))
+        for clause in clauses)
 
 
 def select_from_create_view(sql):
@@ -82,43 +640,46 @@ def field_count_from_select(select):
 
 @functools.lru_cache
 def field_names_from_select(select, *, count=False):
-    select = uncommented(select)
-    as_rx = re.compile(r'\s*(:?.*)\s+[Aa][Ss]\s+(?P<alias>.*)\s*',
-                       re.DOTALL)
-    results = []
-    if match := re.search(r'SELECT(?:\s+(:?ALL|DISTINCT))?\s+'
-                          r'(?P<fields>.*?)(:?\s+FROM|\s*$)', select,
-                          re.IGNORECASE | re.DOTALL):
-        if (fields := match.group('fields')) == '*':
+    names = []
+    star = False
+    for text, alias in _result_columns(parsed(select)):
+        if not text:
+            break
+        if text.endswith('*') and (texts := [
+                match.group(match.lastgroup)
+                for match in TOKEN_RX.finditer(text)
+                if match.lastgroup is not None])[-1:] == ['*'] and (
+                    len(texts) == 1 or texts[-2] == '.'):
+            star = True
+        names.append(_field_name(alias or text))
+    else:
+        if star:
             raise Error('Cannot determine field names from SELECT *')
-        if '(' not in fields:
-            fields = fields.split(',')
-        else:
-            parts = []
-            parens = 0
-            for c in fields:
-                if c == ',' and parens:
-                    parts.append('\f')
-                    continue
-                if c == '(':
-                    parens += 1
-                elif c == ')':
-                    parens -= 1
-                parts.append(c)
-            parts = ''.join(parts)
-            fields = [part.replace('\f', ',') for part in parts.split(',')]
-        if count:
-            return len(fields)
-        for field in fields:
-            alias = None
-            if match := as_rx.match(field):
-                alias = match.group('alias')
-            results.append((alias or field).strip().strip('\'"'))
-        return tuple(results)
+        if names:
+            return len(names) if count else tuple(names)
     raise Error('Failed to determine field names')
 
 
-ITEM_SUMMARY = 'SELECT type, name FROM sqlite_master ORDER BY UPPER(name);'
+def _field_name(text): # text is a result column's (or its alias's) SQL
+    if text[0] in '"\'`[xX' and (match := TOKEN_RX.fullmatch(text)) and (
+            match.lastgroup in {'name', 'string'}):
+        return _unquoted(text)
+    return text
+
+
+# The whole catalogue in one go (see Schema); pragma_table_info() is only
+# given tables' names since a broken view would make it fail
+SCHEMA = '''
+SELECT m.type, m.name, m.tbl_name, m.sql, p.name, p.type, p."notnull",
+       p.dflt_value, p.pk
+    FROM sqlite_master AS m
+    LEFT JOIN pragma_table_info(
+        CASE WHEN m.type = 'table' THEN m.name END) AS p
+    ORDER BY UPPER(m.name), m.name, p.cid;'''
+
+SCHEMA_ITEMS = '''
+SELECT type, name, tbl_name, sql FROM sqlite_master
+    ORDER BY UPPER(name), name;'''
 
 ItemSummary = collections.namedtuple('ItemSummary', ('kind', 'name'))
 
@@ -127,7 +688,18 @@ ITEM_DETAIL = 'SELECT * FROM pragma_table_info(:name);'
 ItemDetail = collections.namedtuple(
     'ItemDetail', ('name', 'type', 'notnull', 'default', 'pk'))
 
-TABLE_OR_VIEW_SQL = 'SELECT sql FROM sqlite_master WHERE name = :name;'
+ItemKind = collections.namedtuple('ItemKind', ('kind', 'sql'))
+
+Column = collections.namedtuple('Column', ('name', 'type'))
+
+# position is the error's offset into the SQL or None if it isn't known
+Invalid = collections.namedtuple('Invalid', ('message', 'position'))
+
+ROWID_MIN = -(2**63)
+
+STAT1_ROWS = '''
+SELECT stat FROM sqlite_stat1 WHERE tbl = :name ORDER BY idx IS NOT NULL
+LIMIT 1;'''
 
 IS_SONGBIRD = '''
 SELECT COUNT(*) FROM sqlite_master WHERE name LIKE 'songbird_%';'''
@@ -141,6 +713,13 @@ if __name__ == '__main__':
             return 1
         return 0
 
+    def check_limit_from_select(n, sql, offset, limit, expected):
+        if (actual := select_limit_from_select(sql, offset,
+                                               limit)) != expected:
+            print(f'{n} SQL: {sql}\n  Exp: {expected}\n  Act: {actual}')
+            return 1
+        return 0
+
     n = errors = 0
     n += 1
     sql = 'select distinct kid, name as "Kiosk Name" from kiosks'
@@ -180,7 +759,225 @@ ORDER BY t2.name DESC;'''
         errors += 1 # unexpected
     except Error:
         pass # expected
+    n += 1
+    errors += check_limit_from_select( # 8
+        n, 'SELECT id FROM stations;', 512, 256,
+        ('SELECT id FROM stations LIMIT :limit OFFSET :offset',
+         dict(limit=256, offset=512)))
+    n += 1
+    errors += check_limit_from_select( # 9
+        n, 'SELECT id FROM stations LIMIT 300 OFFSET 10;', 256, 256,
+        ('SELECT id FROM stations LIMIT :limit OFFSET :offset',
+         dict(limit=44, offset=266)))
+    n += 1
+    if (actual := simple_select_parts(
+            'SELECT id, "Name"\nFROM "Station List"\n--WHERE \n'
+            '--ORDER BY ')) != ('id, "Name"', '"Station List"',
+                                None): # 10
+        print(f'{n} simple_select_parts: {actual}')
+        errors += 1
+    n += 1
+    for sql in ('SELECT id FROM stations WHERE zone IN (SELECT z FROM t)',
+                'SELECT DISTINCT id FROM stations', # 11
+                'SELECT * FROM stations',
+                'SELECT id FROM stations ORDER BY name',
+                'SELECT kid, name FROM kiosks, stations'):
+        if (actual := simple_select_parts(sql)) is not None:
+            print(f'{n} simple_select_parts: {sql!r} → {actual}')
+            errors += 1
+            break
+    n += 1
+    fields = 'id, "Name, Full", \'a,b\' AS ab, x + 1'
+    if (actual := tuple(column_name(field) for field in split_fields(
+            fields))) != ('id', 'Name, Full', None, None): # 12
+        print(f'{n} split_fields/column_name: {actual}')
+        errors += 1
+    n += 1
+    if (actual := lazy_row(fields, '"Big"', (7, 1, None, 'ab', 2,
+                                             '1 blob 5000,'))) != [
+            7, 1, Lazy('Big', 'Name, Full', 7, 'blob', 5000, None), 'ab',
+            2]: # 13
+        print(f'{n} lazy_row: {actual}')
+        errors += 1
+    n += 1
+    for sql, expected in ( # 14
+            ('SELECT id, name\nFROM stations\n--WHERE \n--ORDER BY ',
+             'SELECT id, name\nFROM stations\n--WHERE\nORDER BY name'),
+            ('SELECT a FROM t ORDER BY b DESC LIMIT 5;',
+             'SELECT a FROM t\nORDER BY name LIMIT 5;'),
+            ('SELECT a FROM (SELECT a FROM t ORDER BY a)',
+             'SELECT a FROM (SELECT a FROM t ORDER BY a)\nORDER BY name'),
+            ("SELECT a FROM t WHERE b = 'x ORDER BY y'",
+             "SELECT a FROM t WHERE b = 'x ORDER BY y'\nORDER BY name"),
+            ("SELECT a FROM t -- sorted below\nWHERE b = 'x ORDER BY y'"
+             " ORDER BY a -- why\nLIMIT 9;",
+             "SELECT a FROM t -- sorted below\nWHERE b = 'x ORDER BY y'"
+             "\nORDER BY name LIMIT 9;")):
+        if (actual := select_order_by(sql, 'name')) != expected:
+            print(f'{n} select_order_by: {sql!r} → {actual!r}')
+            errors += 1
+            break
+    n += 1
+    where, bindings = filter_where((('id', '>= 10'), ('zone', ''),
+                                    ('Full Name', '50%'), ('pic', '!null')))
+    if (where, bindings) != ( # 15
+            '"id" >= :f0 AND "Full Name" LIKE :f1 ESCAPE \'\\\' AND '
+            '"pic" IS NOT NULL', (('f0', 10), ('f1', '%50\\%%'))):
+        print(f'{n} filter_where: {where!r} {bindings!r}')
+        errors += 1
+    n += 1
+    for sql, expected in ( # 16
+            ('SELECT id, zone FROM t WHERE zone > 1 ORDER BY id;',
+             'SELECT id, zone FROM t WHERE (zone > 1) AND "id" > :f0 '
+             'ORDER BY id'),
+            ('SELECT id, zone * 2 AS z FROM t',
+             'SELECT * FROM (SELECT id, zone * 2 AS z FROM t) WHERE '
+             '"id" > :f0'),
+            ("SELECT id FROM t WHERE b = 'x ORDER BY y'",
+             "SELECT id FROM t WHERE (b = 'x ORDER BY y') AND "
+             '"id" > :f0'),
+            ('SELECT id FROM t -- WHERE b\nORDER BY id; SELECT 1',
+             'SELECT id FROM t WHERE "id" > :f0 ORDER BY id'),
+            ('SELECT id FROM t ORDER BY id LIMIT 5',
+             'SELECT * FROM (SELECT id FROM t ORDER BY id LIMIT 5) WHERE '
+             '"id" > :f0')):
+        if (actual := select_where(sql, '"id" > :f0')) != expected:
+            print(f'{n} select_where: {sql!r} → {actual!r}')
+            errors += 1
+            break
+    n += 1
+    sql = ("SELECT a, 'x--y' AS \"b /*\", [c d] FROM t -- a, b\n"
+           "/* LIMIT 9 */ WHERE a = ';' LIMIT 10, 5;")
+    if (actual := (uncommented(sql), field_names_from_select(sql),
+                   select_limit_parts(sql))) != ( # 17
+            "SELECT a, 'x--y' AS \"b /*\", [c d] FROM t \n WHERE a = "
+            "';' LIMIT 10, 5;", ('a', 'b /*', 'c d'),
+            ("SELECT a, 'x--y' AS \"b /*\", [c d] FROM t \n WHERE a = "
+             "';' LIMIT :limit OFFSET :offset", 5, 10)):
+        print(f'{n} parsed: {actual}')
+        errors += 1
+    n += 1
+    for sql, expected in ( # 18
+            ('WITH x AS (SELECT 1 AS a) SELECT a, b FROM x', ('a', 'b')),
+            ('SELECT a FROM t WHERE b IS NOT DISTINCT FROM c', ('a',)),
+            ('SELECT f(a, b) AS g FROM (SELECT a FROM t LIMIT 5)',
+             ('g',))):
+        if (actual := field_names_from_select(sql)) != expected:
+            print(f'{n} field_names_from_select: {sql!r} → {actual}')
+            errors += 1
+            break
+    n += 1
+    for sql, expected in ( # 19
+            ('SELECT * FROM main.t AS x JOIN "a b" ON x.i = "a b".i, u',
+             ['t', 'a b', 'u']),
+            ('SELECT * FROM (SELECT i FROM z) AS s LEFT JOIN v USING (i)',
+             ['v'])):
+        if (actual := from_tables(sql)) != expected:
+            print(f'{n} from_tables: {sql!r} → {actual}')
+            errors += 1
+            break
+    n += 1
+    select = 'SELECT id, name FROM t WHERE id > 2'
+    for sql, expected in ( # 20
+            (f'{select}\nORDER BY name DESC', True),
+            (f'{select} -- sorted below\n ORDER  BY id;', True),
+            ('SELECT id FROM t WHERE id > 2\nORDER BY id DESC', False),
+            (f'{select} ORDER BY id LIMIT 5', False)):
+        if (actual := same_rows(sql, f'{select} ORDER BY id')) != (
+                expected):
+            print(f'{n} same_rows: {sql!r} → {actual}')
+            errors += 1
+            break
     if errors:
         print(f'{n - errors:,}/{n:,} passed, {errors:,}/{n:,} failed')
     else:
         print(f'All {n:,} OK')
+    # The helpers share one parse (linear in the SQL's length) so with
+    # the caches cleared only the first helper called parses the SQL; the
+    # old regex helpers (which strings and comments fooled) are timed the
+    # same way, with their caches cleared and then warm
+    import timeit
+
+    @functools.lru_cache
+    def old_uncommented(sql):
+        return re.sub(r'/\*.*?\*/', '', re.sub(r'--.*', '', sql),
+                      flags=re.DOTALL).strip()
+
+    @functools.lru_cache
+    def old_is_select(sql):
+        return re.match(r'\s*SELECT\s', old_uncommented(sql),
+                        re.IGNORECASE) is not None
+
+    @functools.lru_cache
+    def old_select_limit_parts(select):
+        select = old_uncommented(select).rstrip(';').rstrip()
+        limit_rx = re.compile(
+            r'\sLIMIT\s+(?P<limit>\d+)(:?\s+OFFSET\s+(?P<offset>\d+))?',
+            re.IGNORECASE | re.DOTALL)
+        limit = None
+        offset = 0
+        if match := limit_rx.search(select):
+            limit = int(match.group('limit'))
+            if original := match.group('offset'):
+                offset = int(original)
+            select = limit_rx.sub('', select)
+        return select + ' LIMIT :limit OFFSET :offset', limit, offset
+
+    @functools.lru_cache
+    def old_simple_select_parts(select):
+        if match := re.fullmatch(
+                r'\s*SELECT\s+(?P<fields>[^();*]+?)\s+FROM\s+'
+                r'(?P<table>"[^"]+"|\w+)(?:\s+WHERE\s+(?P<where>[^;]+?))?'
+                r'\s*;?\s*', old_uncommented(select),
+                re.IGNORECASE | re.DOTALL):
+            fields, where = match.group('fields', 'where')
+            if not re.match(r'(?:ALL|DISTINCT)\s', fields,
+                            re.IGNORECASE) and (where is None or not (
+                                re.search(r'\b(?:SELECT|GROUP|ORDER|LIMIT|'
+                                          r'HAVING|WINDOW|UNION|EXCEPT|'
+                                          r'INTERSECT)\b', where,
+                                          re.IGNORECASE))):
+                return fields, match.group('table'), where
+
+    @functools.lru_cache
+    def old_field_names_from_select(select):
+        as_rx = re.compile(r'\s*(:?.*)\s+[Aa][Ss]\s+(?P<alias>.*)\s*',
+                           re.DOTALL)
+        names = []
+        if match := re.search(r'SELECT(?:\s+(:?ALL|DISTINCT))?\s+'
+                              r'(?P<fields>.*?)(:?\s+FROM|\s*$)',
+                              old_uncommented(select),
+                              re.IGNORECASE | re.DOTALL):
+            if (fields := match.group('fields')) == '*':
+                raise Error('Cannot determine field names from SELECT *')
+            for field in fields.split(','): # No parentheses in the test
+                alias = None
+                if match := as_rx.match(field):
+                    alias = match.group('alias')
+                names.append((alias or field).strip().strip('\'"'))
+        return tuple(names)
+
+    def call_helpers(helpers, caches, sql, *, cached=True):
+        if not cached:
+            for cache in caches:
+                cache.cache_clear()
+        for helper in helpers:
+            helper(sql)
+
+    new = ((uncommented, is_select, select_limit_parts, simple_select_parts,
+            field_names_from_select),
+           (parsed, select_limit_parts, simple_select_parts,
+            field_names_from_select))
+    old = ((old_uncommented, old_is_select, old_select_limit_parts,
+            old_simple_select_parts, old_field_names_from_select),) * 2
+    for fields in (5, 50, 500):
+        sql = ('SELECT ' + ', '.join(f'"field {i}" AS f{i}'
+                                     for i in range(fields)) +
+               "\nFROM t -- c\nWHERE a = 'x--y' ORDER BY f1 LIMIT 100;")
+        times = [min(timeit.repeat(
+            lambda: call_helpers(*helpers, sql, cached=cached),
+            number=100, repeat=5)) / 100 * 1e6
+            for helpers in (new, old) for cached in (False, True)]
+        print(f'{len(new[0])} helpers × {len(sql):,} chars: '
+              '{:,.1f}µs parsing, {:,.1f}µs cached; the old regexes '
+              '{:,.1f}µs, {:,.1f}µs cached'.format(*times))
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+from PySide2.QtCore import QTimer, Signal
+from PySide2.QtWidgets import QLineEdit, QWidget
+
+from Const import TIMEOUT_FILTER
+
+TOOLTIP = '''<p>Show only the rows whose {name} field:</p>
+<ul><li>contains the text typed, e.g., <tt>ab</tt></li>
+<li>compares as given, e.g., <tt>&gt;= 10</tt> or <tt>!= x</tt>
+(operators: <tt>= != &lt;&gt; &lt; &lt;= &gt; &gt;=</tt>)</li>
+<li>is NULL, <tt>NULL</tt>, or isn't, <tt>!NULL</tt></li></ul>'''
+
+
+class FilterRow(QWidget):
+
+    # A line edit for each of the table view's columns lined up under its
+    # header; changed is emitted when the user has paused typing
+    changed = Signal()
+
+    def __init__(self, tableView):
+        super().__init__()
+        self.tableView = tableView
+        self.edits = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(TIMEOUT_FILTER)
+        self.timer.timeout.connect(self.changed)
+        self.setFixedHeight(QLineEdit().sizeHint().height())
+        header = self.tableView.horizontalHeader()
+        header.sectionResized.connect(self.update_geometries)
+        header.geometriesChanged.connect(self.update_geometries)
+        self.tableView.horizontalScrollBar().valueChanged.connect(
+            self.update_geometries)
+
+
+    def set_names(self, names):
+        # Keeps the filters if the names haven't changed
+        if names == tuple(edit.objectName() for edit in self.edits):
+            return
+        for edit in self.edits:
+            edit.deleteLater()
+        self.edits = []
+        for name in names:
+            edit = QLineEdit(self)
+            edit.setObjectName(name)
+            edit.setPlaceholderText('Filter')
+            edit.setToolTip(TOOLTIP.format(name=name))
+            edit.setClearButtonEnabled(True)
+            edit.textChanged.connect(self.timer.start)
+            edit.show()
+            self.edits.append(edit)
+        self.update_geometries()
+
+
+    @property
+    def filters(self): # (name, text) pairs for Sql.filter_where()
+        return [(edit.objectName(), edit.text()) for edit in self.edits]
+
+
+    def update_geometries(self):
+        header = self.tableView.horizontalHeader()
+        x = self.tableView.frameWidth() + (
+            self.tableView.verticalHeader().width())
+        for i, edit in enumerate(self.edits):
+            edit.setGeometry(x + header.sectionViewportPosition(i), 0,
+                             header.sectionSize(i), self.height())
+
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_geometries()
@@ -78,6 +78,7 @@ class Mixin:
 
 
     def edit_refresh(self):
+        self.refresh_items()
         widget = qApp.focusWidget()
         while widget is not None:
             if isinstance(widget, QMdiSubWindow):
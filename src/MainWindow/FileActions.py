@@ -5,12 +5,15 @@ import pathlib
 
 from PySide2.QtCore import QTimer
 from PySide2.QtGui import QKeySequence, Qt
-from PySide2.QtWidgets import QFileDialog, QMenu, QMessageBox
+from PySide2.QtWidgets import (
+    QCheckBox, QFileDialog, QHBoxLayout, QLabel, QMenu, QMessageBox,
+    QSpinBox, QWidget)
 
 from AppData import (
     DOCUMENT_NEW_SVG, DOCUMENT_OPEN_SVG, EDIT_CLEAR_SVG, EXPORT_SVG,
     FILESAVE_SVG, FILESAVEAS_SVG, IMPORT_SVG, SHUTDOWN_SVG, get_icon)
 from Const import APPNAME, SUFFIX, SUFFIX_DEFAULT, SUFFIXES, TIMEOUT_SHORT
+from Db.Sql import OpenOptions
 from Ui import make_action
 
 
@@ -73,6 +76,8 @@ class Mixin:
         for action in (self.file_save_action, self.file_saveas_action,
                        self.file_backup_action, self.file_export_action):
             action.setEnabled(enable)
+        if self.db.readonly:
+            self.file_save_action.setEnabled(False)
         QTimer.singleShot(0, self.file_populate_open_recent_menu)
 
 
@@ -101,8 +106,9 @@ class Mixin:
 
 
     def file_new(self):
-        if filename := self._file_new_or_open('New',
-                                              QFileDialog.getSaveFileName):
+        filename, _ = self._file_new_or_open('New',
+                                             QFileDialog.getSaveFileName)
+        if filename:
             if filename.exists():
                 QMessageBox.warning(
                     self, f'Database exists — {APPNAME}',
@@ -113,41 +119,45 @@ class Mixin:
 
 
     def file_open(self):
-        if filename := self._file_new_or_open('Open',
-                                              QFileDialog.getOpenFileName):
+        filename, options = self._file_new_or_open('Open',
+                                                   _get_open_file_name)
+        if filename:
             if not filename.exists():
                 QMessageBox.warning(self, f'Database missing — {APPNAME}',
                                     f'Cannot find database {filename}')
             else:
-                self.file_load(filename)
+                self.file_load(filename, options=options)
 
 
     def _file_new_or_open(self, prefix, dialog):
+        # Returns the filename and the dialog's other result
         suffixes = '*' + ' *'.join(SUFFIXES)
-        filename, _ = dialog(self, f'{prefix} database — {APPNAME}',
-                             str(self.path),
-                             f'SQLite ({suffixes});;{APPNAME} ({SUFFIX});;'
-                             'Any file (*.*)')
+        filename, other = dialog(self, f'{prefix} database — {APPNAME}',
+                                 str(self.path),
+                                 f'SQLite ({suffixes});;{APPNAME} '
+                                 f'({SUFFIX});;Any file (*.*)')
         if filename:
             filename = pathlib.Path(filename)
             self.path = filename.parent
             if '.' not in filename.name:
                 filename = filename.with_suffix(SUFFIX_DEFAULT)
-        return filename
+        return filename, other
 
 
-    def file_load(self, filename, new=False):
+    def file_load(self, filename, new=False, *, options=OpenOptions()):
         self.clear() # Will save if necessary
-        self.db.open(filename) # previous is automatically closed
+        self.db.open(filename, options=options) # previous is closed
         self.recent_files.add(filename)
         filename = pathlib.Path(filename).resolve()
-        self.setWindowTitle(f'{filename.name} — {APPNAME}')
+        readonly = ' (read-only)' if self.db.readonly else ''
+        self.setWindowTitle(f'{filename.name}{readonly} — {APPNAME}')
         message = (f'Created new empty database {filename}' if new else
-                   f'Opened database {filename}')
+                   f'Opened database {filename}{readonly}')
         self.statusBar().showMessage(message, TIMEOUT_SHORT)
-        self.refresh_items()
-        self.refresh_pragmas()
+        self.refresh_items(reset=True)
         self.maybe_restore_ui()
+        self.refresh_pragmas() # After maybe_restore_ui() has set them
+        self.watcher.start()
         self.update_ui()
 
 
@@ -178,3 +188,59 @@ class Mixin:
 
     def file_export(self):
         print('file_export') # TODO
+
+
+def _get_open_file_name(parent, caption, path, filters):
+    # Like QFileDialog.getOpenFileName() but returns the chosen open
+    # options instead of the chosen filter; uses Qt's own dialog since
+    # there's no way to add widgets to a native one
+    dialog = QFileDialog(parent, caption, path, filters)
+    dialog.setOption(QFileDialog.DontUseNativeDialog)
+    dialog.setFileMode(QFileDialog.ExistingFile)
+    readonlyCheckBox = QCheckBox('&Read-only')
+    readonlyCheckBox.setToolTip("Open the database so that it can't be "
+                                'changed')
+    immutableCheckBox = QCheckBox('&Immutable')
+    immutableCheckBox.setToolTip(
+        'Open the database read-only on the assumption that no program '
+        'will ever change it, so no locking is needed (fastest for '
+        'archives)')
+    immutableCheckBox.toggled.connect(
+        lambda on: readonlyCheckBox.setChecked(True) if on else None)
+    immutableCheckBox.toggled.connect(readonlyCheckBox.setDisabled)
+    mmapSpinBox = _make_mb_spinbox(
+        'Memory map up to this much of the database (0 means '
+        "SQLite's default)")
+    cacheSpinBox = _make_mb_spinbox(
+        "Use a page cache of up to this size (0 means SQLite's default)")
+    widget = QWidget()
+    hbox = QHBoxLayout(widget)
+    hbox.setContentsMargins(0, 0, 0, 0)
+    hbox.addWidget(readonlyCheckBox)
+    hbox.addWidget(immutableCheckBox)
+    for text, spinBox in (('&Memory map', mmapSpinBox),
+                          ('Ca&che', cacheSpinBox)):
+        label = QLabel(text)
+        label.setBuddy(spinBox)
+        hbox.addWidget(label)
+        hbox.addWidget(spinBox)
+    hbox.addStretch()
+    grid = dialog.layout() # Qt's own dialog uses a QGridLayout
+    row = grid.rowCount()
+    grid.addWidget(QLabel('Options:'), row, 0)
+    grid.addWidget(widget, row, 1, 1, -1)
+    if not dialog.exec_() or not (filenames := dialog.selectedFiles()):
+        return '', None
+    return filenames[0], OpenOptions(
+        readonly=readonlyCheckBox.isChecked(),
+        immutable=immutableCheckBox.isChecked(),
+        mmap_mb=mmapSpinBox.value(), cache_mb=cacheSpinBox.value())
+
+
+def _make_mb_spinbox(tip):
+    spinBox = QSpinBox()
+    spinBox.setRange(0, 64 * 1024)
+    spinBox.setSingleStep(64)
+    spinBox.setSuffix(' MB')
+    spinBox.setToolTip(tip)
+    return spinBox
@@ -4,6 +4,8 @@
 from PySide2.QtWidgets import QMdiArea
 
 import Config
+from Const import TIMEOUT_LONG
+from Db.Sql import Pragmas
 from TableWidget import TableWidget
 
 
@@ -16,6 +18,7 @@ class Mixin:
             return # TODO restore from the db itself
         if (ui := Config.read_db_ui(self.db.filename)) is None:
             return # Haven't seen this database in past year
+        self._restore_pragmas(ui.pragmas) # Before any workers start
         self._restore_overall_ui(ui)
         self._restore_windows_ui(ui.windows)
 
@@ -35,10 +38,21 @@ class Mixin:
         # TODO calendar
 
 
+    def _restore_pragmas(self, pragmas):
+        if pragmas := {name: value for name, value in pragmas.items()
+                       if name in Pragmas.CONNECTION}:
+            if errors := self.db.pragmas_save(Pragmas.unchanged(**pragmas)):
+                error = '; '.join(errors)
+                self.statusBar().showMessage(
+                    f'Failed to restore pragmas: {error}', TIMEOUT_LONG)
+
+
     def _restore_windows_ui(self, windows):
         for window in windows:
             widget = TableWidget(self.db, window.title, window.sql_select,
-                                 self.edit_update_ui)
+                                 self.edit_update_ui,
+                                 streaming=window.streaming,
+                                 completions=self.completions)
             sub_window = self.mdiArea.addSubWindow(widget)
             sub_window.setGeometry(window.x, window.y, window.width,
                                    window.height)
@@ -55,6 +69,7 @@ class Mixin:
         ui.mdi = self.mdiArea.viewMode() == QMdiArea.SubWindowView
         ui.show_items_tree = self.itemsTreeDock.isVisible()
         ui.show_pragmas = self.pragmasDock.isVisible()
+        ui.pragmas = self.db.connection_pragmas
         # ui.show_calendar = self.calendarDock.isVisible() # TODO
         for widget in self.mdiArea.subWindowList():
             child = widget.widget()
@@ -64,5 +79,5 @@ class Mixin:
                 ui.windows.append(Config.DbWindowUi(
                     widget.windowTitle(), child.sql, x=rect.x(), y=rect.y(),
                     width=rect.width(), height=rect.height(),
-                    sizes=child.sizes))
+                    sizes=child.sizes, streaming=child.streaming))
         Config.write_db_ui(ui)
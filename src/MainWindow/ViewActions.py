@@ -128,7 +128,8 @@ class Mixin:
 
     def view_show_item(self):
         widget = self.itemsTreeDock.widget()
-        self.maybe_show_item(widget.currentItem())
+        if widget.can_view():
+            self.maybe_show_item(*widget.current_item)
 
 
     def view_update_ui(self):
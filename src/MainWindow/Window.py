@@ -9,7 +9,10 @@ from PySide2.QtWidgets import QMainWindow, QMdiArea
 import Config
 import Db
 import RecentFiles
+from ChangeWatcher import ChangeWatcher
 from Const import APPNAME, RECENT_FILES_MAX, TIMEOUT_LONG, VERSION
+from SQLEdit.CompletionIndex import CompletionIndex
+from TableWidget import TableWidget
 from Ui import add_actions, make_dock_widget
 from View import ItemsTreeView, PragmaView
 
@@ -22,7 +25,7 @@ class Window(QMainWindow, EditActions.Mixin, FileActions.Mixin,
              HelpActions.Mixin, ItemsTreeView.Mixin, OptionsActions.Mixin,
              PragmaView.Mixin, ViewActions.Mixin, SaveRestoreUi.Mixin):
 
-    def __init__(self, filename):
+    def __init__(self, filename, open_options=Db.Sql.OpenOptions()):
         super().__init__()
         self.setWindowTitle(f'{APPNAME} {VERSION}')
         self.make_variables()
@@ -30,7 +33,7 @@ class Window(QMainWindow, EditActions.Mixin, FileActions.Mixin,
         self.make_actions()
         self.make_connections()
         qApp.commitDataRequest.connect(self.close)
-        options = self.load_options(filename)
+        options = self.load_options(filename, open_options)
         self.update_ui()
         QTimer.singleShot(0, lambda: self.initalize_toggle_actions(options))
 
@@ -47,11 +50,14 @@ class Window(QMainWindow, EditActions.Mixin, FileActions.Mixin,
             show_as_tabs=self.mdiArea.viewMode() == QMdiArea.TabbedView)
         Config.write_main_window_options(options)
         self.clear()
+        self.db.close()
         event.accept()
 
 
     def make_variables(self):
         self.db = Db.Db()
+        self.watcher = ChangeWatcher(self.db, self)
+        self.completions = CompletionIndex()
         self.path = self.export_path = QStandardPaths.writableLocation(
             QStandardPaths.DocumentsLocation)
         self.recent_files = RecentFiles.get(RECENT_FILES_MAX)
@@ -114,12 +120,13 @@ class Window(QMainWindow, EditActions.Mixin, FileActions.Mixin,
 
     def make_connections(self):
         widget = self.itemsTreeDock.widget()
-        widget.itemDoubleClicked.connect(self.maybe_show_item)
-        widget.itemSelectionChanged.connect(self.view_update_ui)
+        widget.item_activated.connect(self.maybe_show_item)
+        widget.current_changed.connect(self.view_update_ui)
+        self.watcher.changed.connect(self.on_external_change)
         # TODO
 
 
-    def load_options(self, filename):
+    def load_options(self, filename, open_options):
         options = Config.read_main_window_options()
         if options.state is not None:
             self.restoreState(options.state)
@@ -134,7 +141,7 @@ class Window(QMainWindow, EditActions.Mixin, FileActions.Mixin,
         if filename:
             if options.last_filename:
                 self.recent_files.add(options.last_filename)
-            self.file_load(filename)
+            self.file_load(filename, options=open_options)
         else:
             self.statusBar().showMessage(
                 'Click File→New or File→Open to open or create a database',
@@ -162,10 +169,18 @@ class Window(QMainWindow, EditActions.Mixin, FileActions.Mixin,
         self.options_update_ui()
 
 
+    def on_external_change(self): # Another process changed the database
+        self.refresh_items() # Only if the schema has changed
+        for widget in self.mdiArea.subWindowList():
+            if isinstance(child := widget.widget(), TableWidget):
+                child.check_for_changes()
+
+
     def clear(self):
-        self.maybe_save_ui()
+        self.watcher.stop()
         widget = self.pragmasDock.widget()
         widget.save(closing=self.closing)
+        self.maybe_save_ui() # After saving any connection pragmas
         widget.clear()
         for widget in self.mdiArea.subWindowList():
             widget.close() # Will save if dirty
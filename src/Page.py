@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+import array
+import sys
+
+# A page of rows held column by column: int and float columns as arrays,
+# text columns as packed UTF-8 (or as codes into a table of distinct
+# strings if there are many repeats), and anything else as a tuple.
+# Cells are only made into Python objects when they're asked for.
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+
+class Page:
+
+    __slots__ = ('_size', '_columns', 'nbytes')
+
+    def __init__(self, rows=()):
+        self._size = len(rows)
+        self._columns = tuple(_column(values) for values in zip(*rows))
+        self.nbytes = sum(column.nbytes for column in self._columns)
+
+
+    def __len__(self):
+        return self._size
+
+
+    def value(self, row, column):
+        return self._columns[column][row]
+
+
+    def row(self, row):
+        return tuple(column[row] for column in self._columns)
+
+
+    def __eq__(self, other):
+        return isinstance(other, Page) and len(self) == len(other) and all(
+            self.row(row) == other.row(row) for row in range(len(self)))
+
+
+def _column(values):
+    kinds = {type(value) for value in values}
+    kinds.discard(type(None))
+    if kinds == {int} and all(INT64_MIN <= value <= INT64_MAX
+                              for value in values if value is not None):
+        return _Numbers('q', values)
+    if kinds == {float}:
+        return _Numbers('d', values)
+    if kinds == {str}:
+        if len(set(values)) * 4 <= len(values):
+            return _Codes(values)
+        return _Texts(values)
+    return _Objects(values)
+
+
+class _Nulls:
+
+    __slots__ = ('bits',)
+
+    def __init__(self, values):
+        self.bits = bytearray((len(values) + 7) // 8)
+        for i, value in enumerate(values):
+            if value is None:
+                self.bits[i >> 3] |= 1 << (i & 7)
+
+
+    def __getitem__(self, i):
+        return self.bits[i >> 3] & (1 << (i & 7))
+
+
+def _nulls(values):
+    return _Nulls(values) if None in values else None
+
+
+class _Numbers:
+
+    __slots__ = ('values', 'nulls')
+
+    def __init__(self, typecode, values):
+        self.nulls = _nulls(values)
+        self.values = array.array(typecode, (0 if value is None else value
+                                             for value in values))
+
+
+    def __getitem__(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return self.values[i]
+
+
+    @property
+    def nbytes(self):
+        return _nbytes(self.nulls) + (self.values.itemsize *
+                                      len(self.values))
+
+
+class _Texts: # All the strings' UTF-8 back to back
+
+    __slots__ = ('data', 'offsets', 'nulls')
+
+    def __init__(self, values):
+        self.nulls = _nulls(values)
+        self.offsets = array.array('q', [0])
+        data = bytearray()
+        for value in values:
+            if value is not None:
+                data += value.encode()
+            self.offsets.append(len(data))
+        self.data = bytes(data)
+
+
+    def __getitem__(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode()
+
+
+    @property
+    def nbytes(self):
+        return (_nbytes(self.nulls) + len(self.data) +
+                self.offsets.itemsize * len(self.offsets))
+
+
+class _Codes: # Each string is an index into a tuple of distinct strings
+
+    __slots__ = ('texts', 'codes')
+
+    def __init__(self, values):
+        codes = {}
+        self.codes = array.array('i', (codes.setdefault(value, len(codes))
+                                       for value in values))
+        self.texts = tuple(codes) # None is just another "string"
+
+
+    def __getitem__(self, i):
+        return self.texts[self.codes[i]]
+
+
+    @property
+    def nbytes(self):
+        return (sum(sys.getsizeof(text) for text in self.texts) +
+                self.codes.itemsize * len(self.codes))
+
+
+class _Objects:
+
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self.values) + sum(
+            sys.getsizeof(value) for value in self.values
+            if value is not None)
+
+
+def _nbytes(nulls):
+    return 0 if nulls is None else len(nulls.bits)
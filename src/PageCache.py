@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+import collections
+
+from Const import PAGE_CACHE_BYTES, PAGE_SIZE
+from Db.Sql import ROWID_MIN
+from Page import Page
+
+
+# query is a Sql.Query; rowid is None for OFFSET pagination; otherwise
+# the page is fetched by seeking to rowid and then skipping offset rows
+Plan = collections.namedtuple(
+    'Plan', ('query', 'page', 'rowid', 'offset', 'count', 'descending'))
+
+
+class PageCache:
+
+    def __init__(self, db, *, page_size=PAGE_SIZE,
+                 max_bytes=PAGE_CACHE_BYTES):
+        self.db = db
+        self.page_size = page_size
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._pages = collections.OrderedDict() # (query, page) → Page
+        self._bounds = {} # (query, page) → (first rowid, last rowid)
+        self._ranges = {} # query → (min rowid, max rowid)
+
+
+    def __contains__(self, key): # key is (query, page)
+        return key in self._pages
+
+
+    def clear(self):
+        self.nbytes = 0
+        self._pages.clear()
+        self._bounds.clear()
+        self._ranges.clear()
+
+
+    def get(self, query, page): # Returns None if page isn't cached
+        key = (query, page)
+        if (rows := self._pages.get(key)) is not None:
+            self._pages.move_to_end(key) # Most recently used
+        return rows
+
+
+    def plan(self, query, page, *, row_count=None):
+        size = self.page_size
+        if (table := self.db.rowid_table(query.select)) is None:
+            return Plan(query, page, None, page * size, size, False)
+        # Keyset pagination: seek from the nearest known rowid boundary
+        # rather than have SQLite step over OFFSET rows
+        if (bounds := self._bounds.get((query, page - 1))) is not None:
+            return Plan(query, page, bounds[1] + 1, 0, size, False)
+        if (bounds := self._bounds.get((query, page + 1))) is not None:
+            return Plan(query, page, bounds[0], 0, size, True)
+        if (rowid := self._dense_rowid(query, table, page,
+                                       row_count)) is not None:
+            return Plan(query, page, rowid, 0, size, False)
+        rowid, skip = ROWID_MIN, page * size
+        if known := [p for s, p in self._bounds if s == query and
+                     p < page]:
+            nearest = max(known)
+            rowid = self._bounds[(query, nearest)][1] + 1
+            skip = (page - nearest - 1) * size
+        return Plan(query, page, rowid, skip, size, False)
+
+
+    @staticmethod
+    def fetch(db, plan): # May be called in any thread with its own db
+        # Returns the page's (first rowid, last rowid) or None, and Page
+        bindings = dict(plan.query.bindings)
+        if plan.rowid is None:
+            return None, Page(db.table_rows(
+                plan.query.select, plan.offset, plan.count, bindings))
+        rows = db.table_rows_seek(
+            plan.query.select, plan.rowid, plan.offset, plan.count,
+            descending=plan.descending, bindings=bindings)
+        if plan.descending:
+            rows.reverse()
+        bounds = (rows[0][0], rows[-1][0]) if rows else None
+        return bounds, Page([row[1:] for row in rows]) # Drop the rowids
+
+
+    def store(self, plan, result):
+        key = (plan.query, plan.page)
+        bounds, page = result
+        if bounds is not None:
+            self._bounds[key] = bounds
+        if (old := self._pages.pop(key, None)) is not None:
+            self.nbytes -= old.nbytes
+        self._pages[key] = page
+        self.nbytes += page.nbytes
+        while self.nbytes > self.max_bytes and len(self._pages) > 1:
+            _, old = self._pages.popitem(last=False) # Least recently used
+            self.nbytes -= old.nbytes
+        return page
+
+
+    def _dense_rowid(self, query, table, page, row_count):
+        # If the rowids have no gaps then page n starts at a known rowid
+        if row_count is None:
+            return None
+        if (bounds := self._ranges.get(query)) is None:
+            bounds = self._ranges[query] = self.db.rowid_range(table)
+        low, high = bounds
+        if low is not None and high - low + 1 == row_count:
+            return low + page * self.page_size
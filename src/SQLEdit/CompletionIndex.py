@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+import bisect
+
+from Const import COMPLETIONS_MAX
+
+from .SQLSyntaxHighlighter import CONSTANTS, FUNCTIONS, KEYWORDS, OPERATORS
+
+
+class CompletionIndex:
+
+    # Sorted lists of (casefolded word, word) pairs searched with bisect:
+    # one for SQL's words and the database's tables and views, and one
+    # per table for its columns; refresh() keeps them up to date with the
+    # Db's schema
+    def __init__(self):
+        self._sql_words = {(word.casefold(), word) for word in
+                           CONSTANTS | FUNCTIONS | KEYWORDS | OPERATORS}
+        self._words = sorted(self._sql_words)
+        self._items = {} # name.lower() → name for each table and view
+        self._columns = {} # table name.lower() → sorted column pairs
+
+
+    def refresh(self, db, changed=None):
+        # changed is None to reread the whole schema or the lowercase names
+        # of the items that have changed (see Db.refresh())
+        items = {item.name.lower(): item.name for item in db.item_summary()
+                 if item.kind in {'table', 'view'}}
+        if changed is None:
+            self._items = items
+            self._words = sorted(self._sql_words | {
+                (name.casefold(), name) for name in items.values()})
+            self._columns = {key: _sorted_columns(db, key)
+                             for key in items}
+            return
+        for key in changed:
+            if (name := self._items.pop(key, None)) is not None:
+                words = self._words
+                i = bisect.bisect_left(words, (name.casefold(), name))
+                if i < len(words) and words[i][1] == name:
+                    del words[i]
+            self._columns.pop(key, None)
+            if (name := items.get(key)) is not None:
+                self._items[key] = name
+                bisect.insort(self._words, (name.casefold(), name))
+                self._columns[key] = _sorted_columns(db, key)
+
+
+    def complete(self, prefix, tables=()):
+        # Returns up to COMPLETIONS_MAX words that start with prefix (case
+        # insensitively) including the columns of the given tables only
+        prefix = prefix.casefold()
+        words = set(_starting_with(self._words, prefix))
+        for table in tables:
+            words.update(_starting_with(
+                self._columns.get(table.lower(), ()), prefix))
+        return sorted(words, key=str.casefold)[:COMPLETIONS_MAX]
+
+
+def _sorted_columns(db, table):
+    return sorted((detail.name.casefold(), detail.name)
+                  for detail in db.item_detail(table))
+
+
+def _starting_with(pairs, prefix):
+    i = bisect.bisect_left(pairs, (prefix,))
+    for i in range(i, min(len(pairs), i + COMPLETIONS_MAX)):
+        if not pairs[i][0].startswith(prefix):
+            break
+        yield pairs[i][1]
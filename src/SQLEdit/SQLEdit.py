@@ -1,17 +1,296 @@
 #!/usr/bin/env python3
 # Copyright © 2020 Mark Summerfield. All rights reserved.
 
-from PySide2.QtWidgets import QPlainTextEdit
+import operator
+import re
+
+from PySide2.QtCore import QStringListModel, Qt, QTimer, Signal
+from PySide2.QtGui import QTextCharFormat, QTextCursor, QTextDocument
+from PySide2.QtWidgets import QCompleter, QPlainTextEdit, QTextEdit
+
+import apsw
+from Const import (
+    COMPLETION_PREFIX, HIGHLIGHT_MARGIN, SQL_LARGE, TIMEOUT_VALIDATE)
+from Db import Sql
+from Worker import Worker
 
 from . import SQLSyntaxHighlighter
 
+PREFIX_RX = re.compile(r'\w*$')
+POPUP_KEYS = frozenset({Qt.Key_Enter, Qt.Key_Return, Qt.Key_Escape,
+                        Qt.Key_Tab, Qt.Key_Backtab})
+
 
 class SQLEdit(QPlainTextEdit):
 
-    def __init__(self, text=''):
+    # If given a CompletionIndex, offers completions when a word's first
+    # COMPLETION_PREFIX characters have been typed or on Ctrl+Space; if
+    # given a Db, checks the SQL when the user pauses typing by preparing
+    # it in a worker thread, underlines any error, and emits validated
+    validated = Signal(object) # Sql.Invalid or None
+
+    def __init__(self, text='', completions=None, db=None):
         super().__init__(text)
-        SQLSyntaxHighlighter.SQLSyntaxHighlighter(self.document())
+        self.completions = completions
+        self.db = db
+        self.invalid = None # The result of checking self.checked
+        self.checked = None # The text that was last checked
+        self._validator = None # A Worker created on demand
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(TIMEOUT_VALIDATE)
+        self.timer.timeout.connect(self.validate)
+        if db is not None:
+            self.textChanged.connect(self.timer.start)
+            self.timer.start()
+        self.completer = None
+        if completions is not None:
+            self.completer = QCompleter(self)
+            self.completer.setWidget(self)
+            self.completer.setModel(QStringListModel(self.completer))
+            self.completer.setCaseSensitivity(Qt.CaseInsensitive)
+            self.completer.setModelSorting(
+                QCompleter.CaseInsensitivelySortedModel)
+            self.completer.activated[str].connect(self.insert_completion)
+        # Connected before the highlighter connects so that large SQL
+        # (e.g., a pasted dump) is only highlighted where it is visible
+        self.document().contentsChange.connect(self.on_contents_change)
+        self.highlighter = SQLSyntaxHighlighter.SQLSyntaxHighlighter(
+            self.document())
+        self.verticalScrollBar().valueChanged.connect(
+            self.update_highlight_window)
+        self.update_highlight_window()
 
 
     def sizeHint(self):
         return self.minimumSizeHint()
+
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_highlight_window()
+
+
+    def on_contents_change(self, position, _removed, _added):
+        number = self.document().findBlock(position).blockNumber()
+        self.highlighter.shift_stale(number)
+        self.update_highlight_window()
+        if self.highlighter.window is not None:
+            self.highlighter.mark_stale(number)
+
+
+    def update_highlight_window(self):
+        window = None
+        if self.document().characterCount() > SQL_LARGE:
+            first = self.firstVisibleBlock().blockNumber()
+            lines = self.viewport().height() // max(
+                1, self.fontMetrics().lineSpacing())
+            window = (max(0, first - HIGHLIGHT_MARGIN),
+                      first + lines + HIGHLIGHT_MARGIN)
+        if window != self.highlighter.window:
+            self.highlighter.set_window(window)
+
+
+    def keyPressEvent(self, event):
+        if self.completer is None:
+            super().keyPressEvent(event)
+            return
+        popup = self.completer.popup()
+        if popup.isVisible() and event.key() in POPUP_KEYS:
+            event.ignore() # The completer handles these
+            return
+        requested = (event.key() == Qt.Key_Space and
+                     bool(event.modifiers() & Qt.ControlModifier))
+        if not requested:
+            super().keyPressEvent(event)
+        prefix = self.completion_prefix()
+        text = event.text()
+        typing = (bool(text) and PREFIX_RX.fullmatch(text) is not None) or (
+            popup.isVisible() and event.key() == Qt.Key_Backspace)
+        if requested or (typing and len(prefix) >= COMPLETION_PREFIX):
+            self.complete(prefix)
+        elif popup.isVisible() and (
+                text or len(prefix) < COMPLETION_PREFIX):
+            popup.hide()
+
+
+    def completion_prefix(self): # The word's characters before the cursor
+        cursor = self.textCursor()
+        text = cursor.block().text()[:cursor.positionInBlock()]
+        return PREFIX_RX.search(text).group()
+
+
+    def complete(self, prefix):
+        words = self.completions.complete(
+            prefix, Sql.from_tables(self.current_statement()))
+        popup = self.completer.popup()
+        if not words:
+            popup.hide()
+            return
+        self.completer.model().setStringList(words)
+        self.completer.setCompletionPrefix(prefix)
+        popup.setCurrentIndex(self.completer.completionModel().index(0, 0))
+        rect = self.cursorRect()
+        rect.setWidth(popup.sizeHintForColumn(0) +
+                      popup.verticalScrollBar().sizeHint().width())
+        self.completer.complete(rect)
+
+
+    def current_statement(self):
+        # The text between the ;s either side of the cursor (simple-minded,
+        # e.g., fooled by strings) found without copying the whole text
+        document = self.document()
+        position = self.textCursor().position()
+        start = document.find(';', position, QTextDocument.FindBackward)
+        end = document.find(';', position)
+        cursor = QTextCursor(document)
+        cursor.setPosition(0 if start.isNull() else start.selectionEnd())
+        end = (document.characterCount() - 1 if end.isNull() else
+               end.selectionStart())
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        return cursor.selectedText().replace('\u2029', '\n')
+
+
+    def insert_completion(self, word):
+        cursor = self.textCursor()
+        cursor.movePosition(QTextCursor.Left, QTextCursor.KeepAnchor,
+                            len(self.completion_prefix()))
+        cursor.insertText(Sql.quoted(word))
+        self.setTextCursor(cursor)
+
+
+    def validate(self, *, force=False): # force if the schema has changed
+        # Large SQL (e.g., a pasted dump) isn't a query so isn't checked
+        if (self.db is None or not bool(self.db) or
+                self.document().characterCount() > SQL_LARGE or
+                ((text := self.toPlainText()) == self.checked and
+                 not force)):
+            return
+        if self._validator is None:
+            try:
+                self._validator = Worker(self.db)
+            except apsw.Error:
+                self.on_validated(text, self.db.sql_error(text))
+                return
+            self._validator.done.connect(self.on_validated)
+        self._validator.cancel() # Older texts needn't be checked
+        self._validator.submit(text, operator.methodcaller('sql_error',
+                                                           text))
+
+
+    def validate_now(self): # Returns the current text's Sql.Invalid or None
+        if self.db is not None and bool(self.db):
+            self.timer.stop()
+            text = self.toPlainText()
+            self.on_validated(text, self.db.sql_error(text))
+        return self.invalid
+
+
+    def on_validated(self, text, invalid):
+        if text != self.toPlainText():
+            return # The user has typed since
+        self.checked = text
+        changed = invalid != self.invalid
+        self.invalid = invalid
+        self.show_invalid()
+        if changed:
+            self.validated.emit(invalid)
+
+
+    def show_invalid(self):
+        selections = []
+        self.setToolTip('' if self.invalid is None else
+                        f'<font color=red>{self.invalid.message}</font>')
+        if self.invalid is not None and self.invalid.position is not None:
+            cursor = QTextCursor(self.document())
+            cursor.setPosition(min(self.invalid.position,
+                                   self.document().characterCount() - 1))
+            cursor.movePosition(QTextCursor.EndOfWord,
+                                QTextCursor.KeepAnchor)
+            if not cursor.hasSelection():
+                cursor.movePosition(QTextCursor.NextCharacter,
+                                    QTextCursor.KeepAnchor)
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = cursor
+            char_format = QTextCharFormat()
+            char_format.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+            char_format.setUnderlineColor(Qt.red)
+            selection.format = char_format
+            selections.append(selection)
+        self.setExtraSelections(selections)
+
+
+    def stop_validating(self):
+        self.timer.stop()
+        if self._validator is not None:
+            self._validator.cancel()
+            self._validator.stop()
+            self._validator = None
+
+
+if __name__ == '__main__': # Run from src as: python3 -m SQLEdit.SQLEdit
+    import time
+
+    from PySide2.QtWidgets import QApplication
+
+    State = SQLSyntaxHighlighter.State
+
+    def settle(seconds=30): # Until every stale block has been updated
+        end = time.monotonic() + seconds
+        while highlighter.stale and time.monotonic() < end:
+            app.processEvents()
+        app.processEvents()
+
+    def edit(position, text='', removed=0):
+        cursor = QTextCursor(editor.document())
+        cursor.setPosition(position)
+        cursor.setPosition(position + removed, QTextCursor.KeepAnchor)
+        cursor.insertText(text)
+
+    def wrong_states(): # The numbers of blocks with an out of date State
+        numbers = []
+        state = State.CODE
+        block = editor.document().firstBlock()
+        while block.isValid():
+            state = SQLSyntaxHighlighter.end_state(block.text(), state)
+            if State(max(block.userState(), State.CODE)) != state:
+                numbers.append(block.blockNumber())
+            block = block.next()
+        return numbers
+
+    app = QApplication([])
+    line = "SELECT name, 'x;' FROM t WHERE id > 1; -- a typical line\n"
+    editor = SQLEdit(line * (SQL_LARGE // len(line) + 1))
+    highlighter = editor.highlighter
+    editor.resize(640, 480)
+    editor.show()
+    settle()
+    n = errors = 0
+    n += 1
+    if numbers := wrong_states():
+        print(f'{n} loaded: {len(numbers):,} blocks with the wrong State')
+        errors += 1
+    # Each edit is reverted before the blocks it made stale are updated;
+    # one idle-time step runs in between so that its region is pending
+    for text, elsewhere in (('/* \n\n\n', False), ('/* ', False),
+                            ('/*\n', True)):
+        n += 1
+        if highlighter.window is None:
+            print(f'{n} {len(editor.toPlainText()):,} characters are not '
+                  'large')
+            errors += 1
+            break
+        edit(0, text)
+        highlighter.update_stale()
+        if elsewhere: # Another stale region later in the document
+            edit(len(line) * 10000, '/* x\n')
+        edit(0, removed=len(text))
+        settle()
+        if numbers := wrong_states():
+            print(f'{n} insert & remove {text!r}: {len(numbers):,} blocks '
+                  f'with the wrong State from {numbers[0]:,}')
+            errors += 1
+    if errors:
+        print(f'{n - errors:,}/{n:,} passed, {errors:,}/{n:,} failed')
+    else:
+        print(f'All {n:,} OK')
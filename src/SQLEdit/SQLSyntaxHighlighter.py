@@ -4,13 +4,15 @@
 import enum
 import re
 
-from PySide2.QtCore import Qt
-from PySide2.QtGui import QColor, QFont, QSyntaxHighlighter, QTextCharFormat
+from PySide2.QtCore import Qt, QTimer
+from PySide2.QtGui import (
+    QColor, QFont, QSyntaxHighlighter, QTextBlockUserData, QTextCharFormat)
 
-from Const import WIN
+from Const import HIGHLIGHT_SLICE, WIN
+from Db.Sql import TOKEN_RX
 
-CONSTANTS = ('TRUE', 'FALSE', 'NULL')
-FUNCTIONS = (
+CONSTANTS = frozenset({'TRUE', 'FALSE', 'NULL'})
+FUNCTIONS = frozenset({
     'ABS', 'AVG', 'CHANGES', 'CHAR', 'COALESCE', 'COUNT', 'DATE',
     'DATETIME', 'GROUP_CONCAT', 'HEX', 'IFNULL', 'IIF', 'INSTR',
     'JULIANDAY', 'LAST_INSERT_ROWID', 'LENGTH', 'LIKELIHOOD', 'LIKELY',
@@ -19,8 +21,8 @@ FUNCTIONS = (
     'SQLITE_COMPILEOPTION_GET', 'SQLITE_COMPILEOPTION_USED',
     'SQLITE_OFFSET', 'SQLITE_SOURCE_ID', 'SQLITE_VERSION', 'STRFTIME',
     'SUBSTR', 'SUM', 'TIME', 'TOTAL', 'TOTAL_CHANGES', 'TRIM', 'TYPEOF',
-    'UNICODE', 'UNLIKELY', 'UPPER', 'ZEROBLOB')
-KEYWORDS = (
+    'UNICODE', 'UNLIKELY', 'UPPER', 'ZEROBLOB'})
+KEYWORDS = frozenset({
     'ABORT', 'ACTION', 'ADD', 'AFTER', 'ALL', 'ALTER', 'ALWAYS', 'ANALYZE',
     'AS', 'ASC', 'ATTACH', 'AUTOINCREMENT', 'BEFORE', 'BEGIN', 'BETWEEN',
     'BY', 'CASCADE', 'CASE', 'CAST', 'CHECK', 'COLLATE', 'COLUMN', 'COMMIT',
@@ -41,9 +43,13 @@ KEYWORDS = (
     'TABLE', 'TEMP', 'TEMPORARY', 'THEN', 'TIES', 'TO', 'TRANSACTION',
     'TRIGGER', 'UNBOUNDED', 'UNION', 'UNIQUE', 'UPDATE', 'USING', 'VACUUM',
     'VALUES', 'VIEW', 'VIRTUAL', 'WHEN', 'WHERE', 'WINDOW', 'WITH',
-    'WITHOUT') 
-OPERATORS = ('IS', 'NOT', 'IN', 'LIKE', 'AND', 'OR', 'GLOB', 'MATCH',
-             'REGEXP')
+    'WITHOUT'})
+OPERATORS = frozenset({'IS', 'NOT', 'IN', 'LIKE', 'AND', 'OR', 'GLOB',
+                       'MATCH', 'REGEXP'})
+OPERATOR_CHARS = frozenset('-+/%*|<>&=!')
+# Only strings, quoted names, and comments matter for a block's State
+STATE_RX = re.compile(r'''[xX]?'[^']*'?|"[^"]*"?|`[^`]*`?|\[[^\]]*\]?|'''
+                      r'--.*|/\*.*?(?:\*/|$)')
 
 
 @enum.unique
@@ -64,10 +70,24 @@ class Syntax(enum.Enum):
     COMMENT = 7
 
 
+class _Stale(QTextBlockUserData): # A block whose formats are out of date
+    pass
+
+
 class SQLSyntaxHighlighter(QSyntaxHighlighter):
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        # window is None to highlight every block as usual or the (first,
+        # last) numbers of the only blocks to highlight (for large SQL);
+        # the others are left for update_stale() to bring up to date
+        self.window = None
+        self.stale = set() # The first blocks of regions whose State may
+        self.blocks = self.document().blockCount() # be wrong
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0) # Work in idle time
+        self.timer.timeout.connect(self.update_stale)
         self.make_formats()
 
 
@@ -98,43 +118,144 @@ class SQLSyntaxHighlighter(QSyntaxHighlighter):
 
 
     def highlightBlock(self, text):
-        state = State.CODE
-        prev_state = State(max(self.previousBlockState(), State.CODE))
+        # One left-to-right pass over the block's tokens (see
+        # Sql.TOKEN_RX) so that nothing inside a string or comment is
+        # highlighted as code
+        if not self.in_window(number := self.currentBlock().blockNumber()):
+            # Leaving the State unchanged stops Qt highlighting the blocks
+            # that follow (whose formats Qt has now cleared)
+            self.setCurrentBlockUserData(_Stale())
+            self.mark_stale(number)
+            return
+        self.setCurrentBlockUserData(None)
+        self.setFormat(0, len(text), self.formats[Syntax.NORMAL])
         i = 0
-        self.setFormat(i, len(text), self.formats[Syntax.NORMAL])
-        if prev_state is State.COMMENT:
-            if (i := text.find('*/')) > -1: # found the end of the comment
-                i += 2
-                self.setFormat(0, i, self.formats[Syntax.COMMENT])
-            else: # whole line is inside the comment
+        if self.previousBlockState() == State.COMMENT:
+            if (i := text.find('*/')) == -1: # whole line is in the comment
                 self.setFormat(0, len(text), self.formats[Syntax.COMMENT])
                 self.setCurrentBlockState(State.COMMENT)
-                return # All in comments
-
-        for pattern, syntax in (
-                (r'\b' + f'({"|".join(CONSTANTS)})' + r'\b',
-                 Syntax.CONSTANT),
-                (r'\b' + f'(?P<func>{"|".join(FUNCTIONS)})(?=[(])',
-                 Syntax.FUNCTION),
-                (r'\b' + f'({"|".join(KEYWORDS)})' + r'\b', Syntax.KEYWORD),
-                (r'\b(\d+(?:\.\d+)?|\.\d+)\b', Syntax.NUMBER),
-                (r'([-+/%*"|<>&=!])', Syntax.OPERATOR),
-                (r'\b' + f'({"|".join(OPERATORS)})' + r'\b',
-                 Syntax.OPERATOR),
-                (r"('[^']+?')", Syntax.STRING),
-                (r'(/\*.*?\*/|--.*$)', Syntax.COMMENT),
-                ):
-            for match in re.finditer(pattern, text,
-                                     re.IGNORECASE | re.DOTALL):
-                start = max(i, match.start(1))
-                end = match.end(1)
-                if end >= start:
-                    self.setFormat(start, end - start, self.formats[syntax])
-
-        if (j := text.find('/*', i)) > -1:
-            if (k := text.find('*/', j)) == -1: # Multi-line comment
-                self.setFormat(j, len(text),    # started but not finished
-                               self.formats[Syntax.COMMENT])
-                self.setCurrentBlockState(State.COMMENT)
                 return
-        self.setCurrentBlockState(State.CODE)
+            i += 2 # found the end of the comment
+            self.setFormat(0, i, self.formats[Syntax.COMMENT])
+        state = State.CODE
+        for match in TOKEN_RX.finditer(text, i):
+            if (kind := match.lastgroup) is None:
+                continue # Trailing whitespace
+            token = match.group(kind)
+            end = match.end()
+            if kind == 'word':
+                if (syntax := self.word_syntax(
+                        token.upper(),
+                        text.startswith('(', end))) is Syntax.NORMAL:
+                    continue
+            elif kind == 'comment':
+                syntax = Syntax.COMMENT
+                if token.startswith('/*') and (len(token) < 4 or
+                                               not token.endswith('*/')):
+                    state = State.COMMENT # Multi-line comment started
+            elif kind == 'string':
+                syntax = Syntax.STRING
+            elif kind == 'number':
+                syntax = Syntax.NUMBER
+            elif kind == 'punct' and token[0] in OPERATOR_CHARS:
+                syntax = Syntax.OPERATOR
+            else:
+                continue # A name, parameter, or other punctuation
+            start = match.start(kind)
+            self.setFormat(start, end - start, self.formats[syntax])
+        self.setCurrentBlockState(state)
+
+
+    @staticmethod
+    def word_syntax(word, is_call):
+        if is_call and word in FUNCTIONS:
+            return Syntax.FUNCTION
+        if word in OPERATORS:
+            return Syntax.OPERATOR
+        if word in KEYWORDS:
+            return Syntax.KEYWORD
+        if word in CONSTANTS:
+            return Syntax.CONSTANT
+        return Syntax.NORMAL
+
+
+    def in_window(self, number):
+        return self.window is None or (
+            self.window[0] <= number <= self.window[1])
+
+
+    def set_window(self, window):
+        if window is None:
+            if self.window is not None:
+                self.window = None
+                self.stale.clear()
+                self.rehighlight()
+            return
+        self.window = window
+        block = self.document().findBlockByNumber(window[0])
+        while block.isValid() and block.blockNumber() <= window[1]:
+            if isinstance(block.userData(), _Stale):
+                self.rehighlightBlock(block)
+            block = block.next()
+
+
+    def mark_stale(self, number):
+        self.stale.add(number)
+        self.timer.start()
+
+
+    def shift_stale(self, number):
+        # Must be called when the document changes at block number and
+        # before anything else is marked stale, so that the regions still
+        # to be updated after it keep up with any blocks added or removed
+        blocks = self.document().blockCount()
+        if moved := blocks - self.blocks:
+            self.stale = {n if n <= number else max(number, n + moved)
+                          for n in self.stale}
+        self.blocks = blocks
+
+
+    def update_stale(self):
+        # Carries the State forward a slice of blocks at a time from the
+        # first stale block until a block's State is unchanged, since all
+        # those that follow are then consistent up to the next stale
+        # region, which is done next; blocks in the window are highlighted
+        # and the others are marked _Stale
+        if not self.stale:
+            return
+        number = min(self.stale)
+        self.stale.discard(number)
+        block = self.document().findBlockByNumber(number)
+        if block.isValid():
+            state = State(max(block.previous().userState(), State.CODE))
+            for _ in range(HIGHLIGHT_SLICE):
+                old = block.userState()
+                if self.in_window(number := block.blockNumber()):
+                    self.rehighlightBlock(block)
+                    state = State(max(block.userState(), State.CODE))
+                else:
+                    state = end_state(block.text(), state)
+                    block.setUserState(state)
+                    block.setUserData(_Stale())
+                self.stale.discard(number)
+                if state == old or not (block := block.next()).isValid():
+                    break
+            else:
+                self.stale.add(block.blockNumber())
+        if self.stale:
+            self.timer.start()
+
+
+def end_state(text, state): # Returns the State at the end of a block
+    i = 0
+    if state is State.COMMENT:
+        if (i := text.find('*/')) == -1:
+            return State.COMMENT
+        i += 2
+    match = None
+    for match in STATE_RX.finditer(text, i):
+        pass
+    if match is not None and (token := match.group()).startswith('/*') and (
+            len(token) < 4 or not token.endswith('*/')):
+        return State.COMMENT
+    return State.CODE
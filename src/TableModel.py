@@ -1,74 +1,693 @@
 #!/usr/bin/env python3
 # Copyright © 2020 Mark Summerfield. All rights reserved.
 
+import functools
+import itertools
+import operator
+
 from PySide2.QtCore import QAbstractTableModel, QModelIndex, Qt, Signal
 
 import apsw
+from Const import PAGE_SIZE, PREFETCH_PAGES
 from Db import Sql
+from Page import Page
+from PageCache import PageCache
+from Worker import Worker
+
+# Rows and row counts are read by worker threads so that the GUI never
+# blocks and the user can cancel long-running queries. A job's key is
+# (generation, kind, detail) and results from an older generation (i.e.,
+# from before a refresh or cancel) are ignored.
+PAGE = 'page'
+STREAM = 'stream'
+COUNT = 'count'
+CHECK = 'check'
 
 
 class TableModel(QAbstractTableModel):
 
     sql_error = Signal(str)
+    row_count_changed = Signal()
+    busy_changed = Signal(bool)
 
-    def __init__(self, db, select, parent=None):
+    def __init__(self, db, select, parent=None, *, page_size=PAGE_SIZE,
+                 streaming=False):
         super().__init__(parent)
         self.db = db
         self.select = select
+        self.where = None # A filter (see Sql.filter_where())
+        self.bindings = () # For where's parameters
+        self.streaming = streaming # Never count: fetch more as needed
+        self.cache = PageCache(db, page_size=page_size)
+        self._fetcher = None # Fetches & streams pages; created on demand
+        self._counter = None # Counts rows; created on demand
+        self._cursor = None # Only used when streaming
+        self._generation = 0
+        self._counts = {} # query → exact row count
+        self.busy = False
+        self._clear()
+
+
+    def _clear(self, *, cache=True): # What depends on the select's data
+        self._cancel_jobs()
+        if cache:
+            self.cache.clear()
+            self._counts.clear()
+        select = self.select
+        if self.where is not None:
+            select = Sql.select_where(select, self.where)
+        self.query = Sql.Query(select, self.bindings)
+        self._close_cursor()
+        self._streamed = [] # Pages when streaming
+        self._row_count = None
+        self.row_count_exact = False
+        self._names = None
+        self._recount = False # The exact row count may be out of date
+        self.error = None
+        self.cancelled = False
+        self._update_busy()
 
 
-    def refresh(self, select):
+    def _cancel_jobs(self):
+        self._generation += 1
+        self._pending = {} # (query, page) → key of job fetching it
+        self._waiting = set() # Keys of jobs the user is waiting for
+        self._checking = False # A check() job is running
+        self._check_pages = None # Those to check() when next idle
+        for worker in (self._fetcher, self._counter):
+            if worker is not None:
+                worker.cancel()
+
+
+    def refresh(self, select): # Any filter won't apply to a new select
+        self.select = select
+        self.where = None
+        self.bindings = ()
+        self._reset()
+
+
+    def _reset(self, *, cache=True):
+        self.beginResetModel()
         try:
-            self.beginResetModel()
+            self._clear(cache=cache)
+        finally:
+            self.endResetModel()
+
+
+    def invalidate(self): # Same select but its data has changed
+        self._reset()
+
+
+    def check(self, pages):
+        # Rereads those of the given (visible) pages that are cached in
+        # the background and invalidates the model if they've changed,
+        # e.g., because another process has written to the database; the
+        # user isn't kept waiting. The row count (if known) is only reread
+        # if the last page is one of them; otherwise it's reread when the
+        # last page is next shown (see prefetch()), so big selects aren't
+        # counted every time the database changes. A check asked for while
+        # busy is run when the model is next idle since the change it's
+        # for won't be signalled again
+        if (self.streaming or not bool(self.db) or
+                self.error is not None or self.cancelled):
+            return
+        if self.busy or self._checking:
+            self._check_pages = pages
+            return
+        count = self._exact_row_count
+        plans = tuple(self.cache.plan(self.query, page, row_count=count)
+                      for page in pages if (self.query, page) in self.cache)
+        if count is not None:
+            if self._recount or not count or (
+                    (count - 1) // self.cache.page_size in pages):
+                self._recount = False
+            else:
+                self._recount = True
+                count = None
+        key = (self._generation, CHECK, (plans, count))
+        self._checking = True
+        self._submit(self._worker('_counter'), key,
+                     functools.partial(_check, query=self.query,
+                                       plans=plans, count=count))
+
+
+    def _on_check(self, detail, result):
+        self._checking = False
+        plans, count = detail
+        if (count is not None and result[0] != count) or any(
+                _changed(self.cache.get(plan.query, plan.page), page)
+                for plan, page in zip(plans, result[1])):
+            self.invalidate()
+
+
+    def reorder(self, select):
+        # If select has the same rows as before but in a different order
+        # the row count is unchanged and any pages already cached for
+        # select (which is part of their key) are still valid; otherwise
+        # (e.g., the SQL was edited since) it is refreshed as a new select.
+        # Returns True if select was only reordered
+        if not Sql.same_rows(select, self.select):
+            self.refresh(select)
+            return False
+        if self.streaming:
+            self.select = select
+            self._reset(cache=False)
+            return True
+        count = None
+        if self.row_count_exact and self.error is None:
+            count = self._row_count
+        self.beginResetModel()
+        try:
+            self.select = select
+            self._clear(cache=False)
+            if count is not None:
+                self._row_count = count
+                self.row_count_exact = True
+        finally:
+            self.endResetModel()
+        return True
+
+
+    def set_filter(self, where, bindings=()):
+        # Cached pages and row counts are kept since they're keyed by
+        # query (which includes where and bindings) so going back to an
+        # earlier filter is fast
+        if (where, bindings) != (self.where, self.bindings):
+            self.where = where
+            self.bindings = bindings
+            self._reset(cache=False)
+
+
+    def cancel(self): # Keep what has been read but stop reading any more
+        if self.busy:
+            self._cancel_jobs()
+            self.cancelled = True
+            self._update_busy()
+            self.row_count_changed.emit()
+
+
+    def set_streaming(self, streaming):
+        if self.streaming != streaming:
+            self.streaming = streaming
+            self._reset(cache=False)
+
+
+    def close(self):
+        self._cancel_jobs()
+        self._close_cursor() # Submitted after the cancel so still run
+        for worker in (self._fetcher, self._counter):
+            if worker is not None:
+                worker.stop()
+        self._fetcher = self._counter = None
+
+
+    def _close_cursor(self):
+        if (cursor := self._cursor) is not None:
+            self._cursor = None # Must be closed in its worker's thread
+            self._submit(self._fetcher, None,
+                         lambda _db: cursor.close(True))
+
+
+    def _worker(self, name):
+        if (worker := getattr(self, name)) is None and bool(self.db):
             try:
-                self.select = select
-            finally:
-                self.endResetModel()
-        except (apsw.SQLError, Sql.Error) as err:
-            self.sql_error.emit(str(err))
+                worker = Worker(self.db)
+            except apsw.Error:
+                return None # _submit() will do the work in this thread
+            worker.done.connect(self.on_done)
+            worker.failed.connect(self.on_failed)
+            setattr(self, name, worker)
+        return worker
+
+
+    def _submit(self, worker, key, function):
+        if worker is not None:
+            worker.submit(key, function)
+        else:
+            try:
+                self.on_done(key, function(self.db))
+            except (apsw.Error, Sql.Error) as err:
+                self.on_failed(key, str(err))
+
+
+    def _update_busy(self):
+        if self.busy != (busy := bool(self._waiting)):
+            self.busy = busy
+            self.busy_changed.emit(busy)
+
+
+    def on_done(self, key, result):
+        if key is None or key[0] != self._generation:
+            return
+        _, kind, detail = key
+        self._waiting.discard(key)
+        if kind == PAGE:
+            self._on_page(detail, result)
+        elif kind == STREAM:
+            self._on_stream(result)
+        elif kind == COUNT:
+            self._set_row_count(result, exact=True)
+        elif kind == CHECK:
+            self._on_check(detail, result)
+        self._update_busy()
+        if not (self.busy or self._checking) and (
+                pages := self._check_pages) is not None:
+            self._check_pages = None
+            self.check(pages)
+
+
+    def on_failed(self, key, err):
+        if key is None or key[0] != self._generation:
+            return
+        _, kind, detail = key
+        if kind == CHECK: # E.g., the table has been dropped
+            self._checking = False
+            self.invalidate() # Will report the error
+            return
+        self._waiting.discard(key)
+        if kind == PAGE:
+            self._pending.pop((detail.query, detail.page), None)
+        elif kind == STREAM:
+            self._cursor = None # Closed along with its statement
+        self.on_error(err) # No more reading until the next refresh
+        if not self.streaming and self._row_count: # Drop the estimate
+            self.beginRemoveRows(QModelIndex(), 0, self._row_count - 1)
+            self._row_count = 0
+            self.endRemoveRows()
+        self.row_count_exact = True
+        self._update_busy()
+        self.row_count_changed.emit()
+
+
+    def _fetch_page(self, page, *, wait=True, update=True):
+        key = (self.query, page)
+        if (job_key := self._pending.get(key)) is None:
+            plan = self.cache.plan(self.query, page,
+                                   row_count=self._exact_row_count)
+            job_key = self._pending[key] = (self._generation, PAGE, plan)
+            self._submit(self._worker('_fetcher'), job_key,
+                         functools.partial(PageCache.fetch, plan=plan))
+        if wait and key in self._pending: # Might have been done already
+            self._waiting.add(job_key)
+            if update:
+                self._update_busy()
+
+
+    def _on_page(self, plan, result):
+        key = (plan.query, plan.page)
+        self._pending.pop(key, None)
+        rows = self.cache.store(plan, result)
+        if plan.page == 0 and self._row_count == 0 and (
+                not self.row_count_exact):
+            # There was no estimate so use the first page's row count
+            if (exact := len(rows) < self.cache.page_size) and (
+                    self._counter is not None):
+                self._waiting = {job for job in self._waiting
+                                 if job[1] != COUNT}
+                self._counter.cancel()
+            self._set_row_count(len(rows), exact=exact)
+        elif rows:
+            first = plan.page * self.cache.page_size
+            last = min(first + len(rows), self.rowCount()) - 1
+            if last >= first:
+                self.dataChanged.emit(
+                    self.index(first, 0),
+                    self.index(last, max(0, self.columnCount() - 1)))
+
+
+    def _set_row_count(self, count, *, exact):
+        old = self._row_count or 0
+        self.row_count_exact = exact
+        if exact:
+            self._counts[self.query] = count
+        if count > old:
+            self.beginInsertRows(QModelIndex(), old, count - 1)
+            self._row_count = count
+            self.endInsertRows()
+        elif count < old:
+            self.beginRemoveRows(QModelIndex(), count, old - 1)
+            self._row_count = count
+            self.endRemoveRows()
+        self.row_count_changed.emit()
+
+
+    def prefetch(self, first, last, direction=1):
+        # Fetch pages just beyond the visible rows, mostly in the
+        # direction of scrolling
+        if (self.streaming or not bool(self.db) or self.rowCount() == 0 or
+                self.error is not None or self.cancelled):
+            return
+        size = self.cache.page_size
+        if self._recount and last // size >= (self.rowCount() - 1) // size:
+            self.check(range(first // size, last // size + 1))
+        steps = range(1, PREFETCH_PAGES + 1)
+        ahead = [last // size + i for i in steps]
+        behind = [first // size - 1]
+        if direction < 0:
+            ahead = [first // size - i for i in steps]
+            behind = [last // size + 1]
+        for page in ahead + behind:
+            if (0 <= page and page * size < self.rowCount() and
+                    (self.query, page) not in self.cache):
+                self._fetch_page(page, wait=False)
 
 
     def rowCount(self, parent=QModelIndex()):
-        try:
-            return self.db.select_row_count(self.select)
-        except (apsw.SQLError, Sql.Error) as err:
-            self.sql_error.emit(str(err))
+        if parent.isValid():
             return 0
+        if self._row_count is None and not self.streaming and (
+                count := self._counts.get(self.query)) is not None:
+            self._row_count = count
+            self.row_count_exact = True
+        elif self._row_count is None:
+            self._row_count = 0
+            try:
+                if self.streaming:
+                    self._stream()
+                else:
+                    self._row_count = self._estimate_row_count()
+            except (apsw.SQLError, Sql.Error) as err:
+                self.row_count_exact = True
+                self.on_error(err)
+            self._update_busy() # Only now that the row count is known
+        return self._row_count
+
+
+    @property
+    def _exact_row_count(self):
+        count = self.rowCount()
+        return count if self.row_count_exact else None
+
+
+    def _estimate_row_count(self):
+        # Returns an immediate estimate and counts in the background; if
+        # there's no estimate, returns 0 and uses the first page's row
+        # count when it arrives
+        if not bool(self.db):
+            self.row_count_exact = True
+            return 0
+        count = self.db.select_row_estimate(self.query.select)
+        key = (self._generation, COUNT, self.query)
+        self._waiting.add(key)
+        self._submit(self._worker('_counter'), key,
+                     operator.methodcaller('select_row_count',
+                                           self.query.select,
+                                           dict(self.query.bindings)))
+        if self.row_count_exact: # Counted in this thread
+            return self._row_count
+        if count is None:
+            self._fetch_page(0, update=False)
+        return count or 0
+
+
+    def _stream(self):
+        key = (self._generation, STREAM, None)
+        if key not in self._waiting:
+            self._waiting.add(key)
+            self._submit(self._worker('_fetcher'), key,
+                         functools.partial(_stream, query=self.query,
+                                           cursor=self._cursor,
+                                           count=self.cache.page_size))
+            self._update_busy()
+
+
+    def _on_stream(self, result):
+        self._cursor, rows = result
+        if rows:
+            first = self.rowCount()
+            last = first + len(rows) - 1
+            self.beginInsertRows(QModelIndex(), first, last)
+            self._streamed.append(rows)
+            self._row_count += len(rows)
+            self.endInsertRows()
+        self.row_count_exact = self._cursor is None
+        self.row_count_changed.emit()
+
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return (self.streaming and not parent.isValid() and
+                self._cursor is not None and not self.cancelled)
+
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self._stream()
 
 
     def columnCount(self, parent=QModelIndex()):
-        try:
-            try:
-                return Sql.field_count_from_select(self.select)
-            except Sql.Error:
-                return len(self.db.field_names_for_select(self.select))
-        except apsw.SQLError as err:
-            self.sql_error.emit(str(err))
+        if parent.isValid():
             return 0
+        return len(self.field_names)
+
+
+    @property
+    def field_names(self):
+        if self._names is None:
+            try:
+                try:
+                    self._names = Sql.field_names_from_select(self.select)
+                except Sql.Error:
+                    self._names = tuple(
+                        self.db.field_names_for_select(self.select) or ())
+            except apsw.SQLError as err:
+                self._names = ()
+                self.on_error(err)
+        return self._names
 
 
     def data(self, index, role):
-        try:
-            if (not index.isValid() or index.row() >= self.rowCount() or
-                    index.column() >= self.columnCount()):
-                return
-            if role == Qt.DisplayRole:
-                row = self.db.table_row(self.select, index.row())
-                return row[index.column()]
-        except (apsw.SQLError, Sql.Error) as err:
-            self.sql_error.emit(str(err))
+        if role == Qt.DisplayRole:
+            value = self.value(index)
+            return str(value) if isinstance(value, Sql.Lazy) else value
+        if role == Qt.ToolTipRole and isinstance(
+                value := self.value(index, fetch=False), Sql.Lazy):
+            return (f'{Sql.human_size(value.size)} {value.kind.upper()} '
+                    '(double-click to save it)')
+
+
+    def value(self, index, *, fetch=True):
+        # Returns the cell's value (which may be a Sql.Lazy); if its page
+        # isn't cached, returns None and (if fetch) requests the page
+        if (not index.isValid() or index.row() >= self.rowCount() or
+                index.column() >= self.columnCount()):
+            return
+        page, offset = divmod(index.row(), self.cache.page_size)
+        if self.streaming:
+            return self._streamed[page].value(offset, index.column())
+        if (rows := self.cache.get(self.query, page)) is not None:
+            if offset < len(rows):
+                return rows.value(offset, index.column())
+        elif fetch and self.error is None and not self.cancelled:
+            self._fetch_page(page) # dataChanged is emitted on arrival
+
+
+    def on_error(self, err):
+        # Only the first error is reported: the jobs that are still
+        # running would most likely fail the same way
+        if self.error is None:
+            self.error = str(err)
+            self.sql_error.emit(self.error)
 
 
     def headerData(self, section, orientation, role):
         if role != Qt.DisplayRole:
             return
         if orientation == Qt.Horizontal:
-            try:
-                try:
-                    names = Sql.field_names_from_select(self.select)
-                except Sql.Error:
-                    names = self.db.field_names_for_select(self.select)
-                return names[section]
-            except apsw.SQLError as err:
-                self.sql_error.emit(str(err))
+            if section < len(self.field_names):
+                return self.field_names[section]
+            return
         return f'{section + 1:,}'
+
+
+def _changed(cached, page): # cached is None if it has been evicted
+    return cached is not None and cached != page
+
+
+def _check(db, *, query, plans, count): # Runs in a worker thread
+    if count is not None:
+        count = db.select_row_count(query.select, dict(query.bindings))
+    return count, [PageCache.fetch(db, plan)[1] for plan in plans]
+
+
+def _stream(db, *, query, cursor, count): # Runs in a worker thread
+    if cursor is None:
+        cursor = db.select_cursor(query.select, dict(query.bindings))
+    rows = list(itertools.islice(cursor, count))
+    if len(rows) < count: # Read all there is
+        cursor.close(True)
+        cursor = None
+    return cursor, Page(rows)
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import time
+
+    from PySide2.QtCore import QCoreApplication
+
+    import Db
+    from Const import WORKERS_MAX
+
+    def wait(model, seconds=10): # Until the model's jobs are done
+        end = time.monotonic() + seconds
+        while (model.busy or model._checking) and time.monotonic() < end:
+            app.processEvents()
+            time.sleep(0.01)
+        app.processEvents()
+
+    app = QCoreApplication([])
+    filename = os.path.join(tempfile.mkdtemp(), 'test.db')
+    connection = apsw.Connection(filename)
+    with connection:
+        connection.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, '
+                           'name TEXT)')
+        connection.executemany('INSERT INTO t (name) VALUES (?)',
+                               ((f'n{i}',) for i in range(4000)))
+    db = Db.Db(filename)
+    n = errors = 0
+    n += 1
+    model = TableModel(db, 'SELECT nosuch FROM t') # 1
+    errors_seen = []
+    model.sql_error.connect(errors_seen.append)
+    model.rowCount() # Estimates (from the rowids) and counts
+    wait(model)
+    if (actual := (model.rowCount(), len(errors_seen))) != (0, 1):
+        print(f'{n} invalid query: row count & errors {actual}')
+        errors += 1
+    model.close()
+    n += 1
+    model = TableModel(db, '', streaming=True) # 2
+    for select, expected in (
+            ('SELECT id FROM t WHERE id < 7; SELECT name, id FROM t',
+             [1, 2, 3, 4, 5, 6]),
+            ('SELECT id FROM t LIMIT 3 OFFSET 2', [3, 4, 5])):
+        model.refresh(select)
+        model.rowCount()
+        wait(model)
+        actual = [model.value(model.index(row, 0))
+                  for row in range(model.rowCount())]
+        if actual != expected:
+            print(f'{n} streamed {select!r}: {actual}')
+            errors += 1
+            break
+    model.close()
+    n += 1
+    models = [] # 3 Five windows' models share WORKERS_MAX readers
+    for i in range(5):
+        model = TableModel(db, f'SELECT id, name FROM t WHERE id > {i}')
+        model.rowCount()
+        model.check(range(1))
+        models.append(model)
+    lent = len(db._lent)
+    for model in models:
+        wait(model)
+    if lent > WORKERS_MAX or [model.rowCount() for model in models] != [
+            4000 - i for i in range(5)]:
+        print(f'{n} 5 models: {lent} readers lent (expected at most '
+              f'{WORKERS_MAX}), {[model.rowCount() for model in models]}')
+        errors += 1
+    for model in models:
+        model.close()
+    if db._lent:
+        print(f'{n} 5 models closed: {len(db._lent)} readers still lent')
+        errors += 1
+    n += 1
+    model = TableModel(db, 'SELECT id, name FROM t WHERE id > 0') # 4
+    model.rowCount()
+    wait(model)
+    model.value(model.index(0, 0)) # Fetches the first page
+    wait(model)
+    with connection: # Another process appends rows
+        connection.executemany('INSERT INTO t (name) VALUES (?)',
+                               ((f'm{i}',) for i in range(10)))
+    model.check(range(1)) # Only the first page is visible
+    wait(model)
+    counts = [model.rowCount()] # The count isn't reread yet
+    last = model.rowCount() - 1
+    model.prefetch(last - 20, last) # The last page is shown
+    wait(model)
+    model.rowCount()
+    wait(model)
+    counts.append(model.rowCount())
+    if counts != [4000, 4010]:
+        print(f'{n} row counts after appending: {counts} (expected '
+              '[4000, 4010])')
+        errors += 1
+    model.close()
+    n += 1
+    before = db.statement_cache_stats() # 5
+    pages = 5
+    for page in range(pages): # Every page's LIMIT & OFFSET are bound
+        db.table_rows('SELECT name FROM t WHERE id > 10', page * 100, 100)
+    if before is not None and (hits := db.statement_cache_stats()[
+            'hits'] - before['hits']) < pages - 1:
+        print(f'{n} paged select reused its prepared statement {hits} '
+              f'times (expected {pages - 1})')
+        errors += 1
+    n += 1
+    with connection: # 6
+        connection.execute('CREATE TABLE u (id INTEGER PRIMARY KEY)')
+    indexed = db.select_sort_indexed(
+        'SELECT id, name FROM t ORDER BY name; DROP TABLE u')
+    if indexed or not Sql.first(connection.cursor(), "SELECT COUNT(*) "
+                                "FROM sqlite_master WHERE name = 'u'"):
+        print(f'{n} explained a trailing statement: indexed={indexed}, '
+              'table u dropped')
+        errors += 1
+    n += 1
+    model = TableModel(db, 'SELECT id, name FROM t WHERE id <= 3') # 7
+    model.rowCount()
+    wait(model)
+    actual = []
+    for select in ('SELECT id, name FROM t WHERE id <= 3\nORDER BY id DESC',
+                   'SELECT id FROM t WHERE id > 4008\nORDER BY id DESC'):
+        reordered = model.reorder(select) # The second was edited too
+        model.rowCount()
+        wait(model)
+        model.value(model.index(0, 0)) # Fetches the first page
+        wait(model)
+        actual.append((reordered, [
+            model.value(model.index(row, 0))
+            for row in range(model.rowCount())]))
+    if actual != [(True, [3, 2, 1]), (False, [4010, 4009])]:
+        print(f'{n} reordered: {actual}')
+        errors += 1
+    model.close()
+    n += 1
+    counts = [] # 8
+    for select in ('SELECT id FROM t WHERE id > 4000;',
+                   'SELECT id FROM t LIMIT 3 OFFSET 4008; -- the end'):
+        model = TableModel(db, select)
+        model.rowCount()
+        wait(model)
+        counts.append((model.rowCount(), model.row_count_exact,
+                       model.error))
+        model.close()
+    if counts != [(10, True, None), (2, True, None)]:
+        print(f'{n} counted selects ending with ";": {counts}')
+        errors += 1
+    n += 1
+    model = TableModel(db, 'SELECT id, name FROM t WHERE id <= 3') # 9
+    model.rowCount()
+    wait(model)
+    model.value(model.index(0, 1)) # Fetches the first page
+    wait(model)
+    model.check(range(1))
+    time.sleep(0.2) # The check has read the page but not reported back
+    with connection:
+        connection.execute("UPDATE t SET name = 'new' WHERE id = 1")
+    model.check(range(1)) # Signalled while the first check is running
+    wait(model)
+    model.value(model.index(0, 1))
+    wait(model)
+    if (actual := model.value(model.index(0, 1))) != 'new':
+        print(f'{n} change signalled while checking: {actual!r}')
+        errors += 1
+    model.close()
+    db.close()
+    os.remove(filename)
+    if errors:
+        print(f'{n - errors:,}/{n:,} passed, {errors:,}/{n:,} failed')
+    else:
+        print(f'All {n:,} OK')
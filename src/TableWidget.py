@@ -1,58 +1,107 @@
 #!/usr/bin/env python3
 # Copyright © 2020 Mark Summerfield. All rights reserved.
 
+import collections
 import re
 
-from PySide2.QtCore import Qt
+from PySide2.QtCore import QElapsedTimer, Qt, QTimer
 from PySide2.QtWidgets import (
-    QLabel, QMessageBox, QSplitter, QTableView, QVBoxLayout, QWidget)
+    QCheckBox, QFileDialog, QHBoxLayout, QLabel, QMessageBox, QPushButton,
+    QSplitter, QTableView, QVBoxLayout, QWidget)
 
 import apsw
+import FilterRow
 import TableModel
-from Const import APPNAME
+from Const import APPNAME, TIMEOUT_BUSY
 from Db import Sql
 from SQLEdit import SQLEdit
 
 
+Sort = collections.namedtuple('Sort', ('section', 'descending', 'indexed'))
+
+
 class TableWidget(QWidget):
 
-    def __init__(self, db, name, select, update_ui):
+    def __init__(self, db, name, select, update_ui, *, streaming=False,
+                 completions=None):
         super().__init__()
         self.db = db
         self.setWindowTitle(name)
         self.dirty = False
-        self.make_widgets(select)
+        self.scroll_value = 0
+        self.sort = None # Set when the user clicks a column's header
+        self.make_widgets(select, streaming, completions)
         self.make_layout()
         self.make_connections(update_ui)
+        self.on_busy(self.tableModel.busy)
+        QTimer.singleShot(0, self.prefetch)
 
 
-    def make_widgets(self, select):
-        self.sqlEdit = SQLEdit.SQLEdit(select)
+    def make_widgets(self, select, streaming, completions):
+        self.sqlEdit = SQLEdit.SQLEdit(select, completions, self.db)
         self.sqlEdit.setTabChangesFocus(True)
-        self.tableModel = TableModel.TableModel(self.db,
-                                                Sql.uncommented(select))
+        self.tableModel = TableModel.TableModel(
+            self.db, Sql.uncommented(select), streaming=streaming)
         self.tableView = QTableView()
         self.tableView.setModel(self.tableModel)
+        self.tableView.horizontalHeader().setSectionsClickable(True)
+        self.filterRow = FilterRow.FilterRow(self.tableView)
+        self.filterRow.set_names(self.tableModel.field_names)
         self.statusLabel = QLabel()
         self.statusLabel.setTextFormat(Qt.RichText)
-        self.update_status(select)
+        self.streamingCheckBox = QCheckBox('Stream Rows')
+        self.streamingCheckBox.setChecked(streaming)
+        self.streamingCheckBox.setToolTip(
+            'Fetch rows as they are scrolled to without counting them '
+            'first (for expensive queries)')
+        self.cancelButton = QPushButton('Cancel')
+        self.cancelButton.setToolTip('Stop reading rows (those already '
+                                     'read are kept)')
+        self.cancelButton.hide()
+        self.elapsed = QElapsedTimer()
+        self.elapsed.start()
+        self.busyTimer = QTimer(self)
+        self.busyTimer.setInterval(TIMEOUT_BUSY)
 
 
     def make_layout(self):
         self.splitter = QSplitter(Qt.Vertical)
         self.splitter.addWidget(self.sqlEdit)
-        self.splitter.addWidget(self.tableView)
+        vbox = QVBoxLayout()
+        vbox.setContentsMargins(0, 0, 0, 0)
+        vbox.setSpacing(0)
+        vbox.addWidget(self.filterRow)
+        vbox.addWidget(self.tableView)
+        widget = QWidget()
+        widget.setLayout(vbox)
+        self.splitter.addWidget(widget)
         self.splitter.setStretchFactor(1, 11)
         vbox = QVBoxLayout()
         vbox.addWidget(self.splitter)
-        vbox.addWidget(self.statusLabel)
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.statusLabel, 1)
+        hbox.addWidget(self.cancelButton)
+        hbox.addWidget(self.streamingCheckBox)
+        vbox.addLayout(hbox)
         self.setLayout(vbox)
 
 
     def make_connections(self, update_ui):
         self.sqlEdit.textChanged.connect(update_ui)
         self.sqlEdit.copyAvailable.connect(update_ui)
+        self.sqlEdit.validated.connect(self.on_validated)
         self.tableModel.sql_error.connect(self.on_sql_error)
+        self.tableModel.row_count_changed.connect(self.update_status)
+        self.tableModel.busy_changed.connect(self.on_busy)
+        self.cancelButton.clicked.connect(self.tableModel.cancel)
+        self.busyTimer.timeout.connect(self.update_status)
+        self.tableView.verticalScrollBar().valueChanged.connect(
+            self.prefetch)
+        self.tableView.doubleClicked.connect(self.on_double_clicked)
+        self.tableView.horizontalHeader().sectionClicked.connect(
+            self.on_sort)
+        self.filterRow.changed.connect(self.on_filter)
+        self.streamingCheckBox.toggled.connect(self.on_streaming)
 
 
     @property
@@ -65,15 +114,22 @@ class TableWidget(QWidget):
         return Sql.is_select(self.sql)
 
 
+    @property
+    def streaming(self):
+        return self.tableModel.streaming
+
+
     @property
     def sql(self):
         return self.sqlEdit.toPlainText()
 
 
-    def refresh(self):
+    def refresh(self, *, reorder=False):
         if not self.is_select:
             self.statusLabel.setText('<font color=red>Only SELECT '
                                      'statements are supported here</font>')
+        elif (invalid := self.sqlEdit.validate_now()) is not None:
+            self.on_sql_error(invalid.message) # Don't run what won't work
         else:
             select = Sql.uncommented(self.sqlEdit.toPlainText())
             if re.match(r'\s*SELECT(:?\s+(:?ALL|DISTINCT))?\s+\*',
@@ -86,25 +142,150 @@ class TableWidget(QWidget):
                 except apsw.SQLError as err:
                     self.on_sql_error(str(err))
                     return
-            self.tableModel.refresh(select)
-            self.update_status(select)
+            if reorder:
+                reordered = self.tableModel.reorder(select)
+            else:
+                self.sort = None
+                self.tableView.horizontalHeader().setSortIndicatorShown(
+                    False)
+                self.tableModel.refresh(select)
+                reordered = False
+            if not reordered: # A new select (the SQL may have been edited)
+                self.filterRow.set_names(self.tableModel.field_names)
+                self.on_filter() # Reapply the filters (if any)
+            self.update_status()
+            QTimer.singleShot(0, self.prefetch)
+
+
+    def on_filter(self):
+        # The filters are bound parameters so that SQLite can reuse the
+        # statements it has already prepared as the user types
+        self.tableModel.set_filter(
+            *Sql.filter_where(self.filterRow.filters))
+        self.update_status()
+        QTimer.singleShot(0, self.prefetch)
+
+
+    def on_sort(self, section):
+        # SQLite does the sorting: the select's ORDER BY is replaced and
+        # the model re-reads (only) the rows that are shown
+        if not self.is_select or section >= len(
+                names := self.tableModel.field_names):
+            return
+        descending = (self.sort is not None and
+                      self.sort.section == section and
+                      not self.sort.descending)
+        name = names[section]
+        field = name if re.fullmatch(r'\w+', name) else str(section + 1)
+        sql = Sql.select_order_by(
+            self.sql, f'{field} DESC' if descending else field)
+        self.sqlEdit.setPlainText(sql)
+        try:
+            indexed = self.db.select_sort_indexed(Sql.uncommented(sql))
+        except apsw.SQLError as err:
+            self.on_sql_error(str(err))
+            return
+        self.sort = Sort(section, descending, indexed)
+        header = self.tableView.horizontalHeader()
+        header.setSortIndicator(section, Qt.DescendingOrder if descending
+                                else Qt.AscendingOrder)
+        header.setSortIndicatorShown(True)
+        self.refresh(reorder=True)
+
+
+    def on_streaming(self, streaming):
+        self.tableModel.set_streaming(streaming)
+        self.update_status()
+
+
+    def on_busy(self, busy):
+        self.cancelButton.setVisible(busy)
+        if busy:
+            self.elapsed.start()
+            self.busyTimer.start()
+        else:
+            self.busyTimer.stop()
+        self.update_status()
+
+
+    def prefetch(self, value=None):
+        if value is None:
+            value = self.tableView.verticalScrollBar().value()
+        direction = -1 if value < self.scroll_value else 1
+        self.scroll_value = value
+        first = max(0, self.tableView.rowAt(0))
+        if (last := self.tableView.rowAt(
+                self.tableView.viewport().height() - 1)) == -1:
+            last = self.tableModel.rowCount() - 1
+        self.tableModel.prefetch(first, last, direction)
+
+
+    def on_double_clicked(self, index):
+        if not isinstance(lazy := self.tableModel.value(index), Sql.Lazy):
+            return
+        suffix = '.txt' if lazy.kind == 'text' else '.bin'
+        filename, _ = QFileDialog.getSaveFileName(
+            self, f'Save {lazy.column} Value — {APPNAME}',
+            f'{lazy.table}-{lazy.column}-{lazy.rowid}{suffix}')
+        if filename:
+            try:
+                self.db.value_save(lazy, filename)
+            except (apsw.Error, OSError) as err:
+                QMessageBox.warning(self, f'Save error — {APPNAME}',
+                                    f'Failed to save:\n{err}')
 
 
     def on_sql_error(self, err):
         self.statusLabel.setText(f'<font color=red>{err}</font>')
 
 
-    def update_status(self, select):
-        try:
-            count = self.db.select_row_count(select)
+    def on_validated(self, invalid):
+        if invalid is None:
+            self.update_status()
+        else:
+            self.on_sql_error(invalid.message)
+
+
+    def check_for_changes(self): # Rereads the visible rows' pages
+        self.sqlEdit.validate(force=True) # E.g., a missing table's made
+        view = self.tableView
+        first = max(0, view.rowAt(0))
+        if (last := view.rowAt(view.viewport().height() - 1)) < 0:
+            last = self.tableModel.rowCount() - 1
+        size = self.tableModel.cache.page_size
+        self.tableModel.check(range(first // size, last // size + 1))
+
+
+    def update_status(self):
+        count = self.tableModel.rowCount()
+        if self.tableModel.error is not None:
+            self.on_sql_error(self.tableModel.error)
+            return
+        if self.tableModel.row_count_exact:
             s = 's' if count != 1 else ''
-            self.statusLabel.setText(f'{count:,} row{s}')
-        except (apsw.SQLError, Sql.Error) as err:
-            self.on_sql_error(str(err))
+            text = f'{count:,} row{s}'
+        elif self.tableModel.cancelled:
+            text = f'{approximate(count)}? rows <i>(cancelled)</i>'
+        elif self.tableModel.streaming:
+            text = f'{count:,}+ rows <i>(scroll for more)</i>'
+        else:
+            text = f'~{approximate(count)} rows <i>(counting…)</i>'
+        if self.tableModel.where is not None:
+            text += ' <i>(filtered)</i>'
+        if self.sort is not None:
+            name = self.tableModel.field_names[self.sort.section]
+            how = 'indexed' if self.sort.indexed else 'not indexed'
+            text += f' sorted by {name} <i>({how})</i>'
+        if self.tableModel.busy:
+            secs = self.elapsed.elapsed() / 1000
+            text += f' <i>{secs:.1f}s</i>'
+        self.statusLabel.setText(text)
 
 
     def closeEvent(self, event):
         self.save(closing=True)
+        self.sqlEdit.stop_validating()
+        self.tableModel.close()
         event.accept()
 
 
@@ -124,3 +305,10 @@ class TableWidget(QWidget):
                 saved = True
                 self.dirty = False
         return saved
+
+
+def approximate(count):
+    for size, suffix in ((10**9, 'G'), (10**6, 'M'), (10**3, 'K')):
+        if count >= size:
+            return f'{count / size:.1f}'.rstrip('0').rstrip('.') + suffix
+    return f'{count:,}'
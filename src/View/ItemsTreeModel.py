@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+from PySide2.QtCore import QAbstractItemModel, QModelIndex, Qt
+from PySide2.QtGui import QBrush, QFont
+
+# The top-level rows are groups and their children are the database's
+# items (only those whose names match the filter); a table's columns are
+# only read when it is first expanded (see fetchMore()). An index's
+# internalId() says what it is: 0 for a group, the group + 1 for an
+# item, or COLUMNS + n for the columns of the table in self._tables[n].
+GROUPS = (('Queries', 'query'), ('Tables', 'table'), ('Views', 'view'),
+          ('Triggers', 'trigger'), ('Indexes', 'index'))
+TABLES = 1 # The Tables group
+COLUMNS = len(GROUPS) + 1
+
+
+class ItemsTreeModel(QAbstractItemModel):
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.filter = ''
+        self._clear()
+
+
+    def _clear(self):
+        self._items = [[] for _ in GROUPS] # names (all of them)
+        self._names = [[] for _ in GROUPS] # names that match the filter
+        self._rows = [{} for _ in GROUPS] # name → row in _names
+        self._tables = [] # names of tables whose columns have been read
+        self._ids = {} # table name → its index in _tables
+        self._columns = [] # Sql.ItemDetail tuples for each of _tables
+
+
+    def refresh(self, changed=None):
+        # changed is None or the lowercase names of the items that have
+        # changed (see Db.refresh()); other tables' columns are kept
+        self.beginResetModel()
+        kept = () if changed is None else [
+            (name, columns) for name, columns in zip(self._tables,
+                                                     self._columns)
+            if name.lower() not in changed]
+        self._clear()
+        if bool(self.db):
+            kinds = {kind: group for group, (_, kind) in enumerate(GROUPS)}
+            for item in self.db.item_summary():
+                if (group := kinds.get(item.kind)) is not None:
+                    self._items[group].append(item.name)
+        for name, columns in kept:
+            self._ids[name] = len(self._tables)
+            self._tables.append(name)
+            self._columns.append(columns)
+        self._apply_filter()
+        self.endResetModel()
+
+
+    def set_filter(self, text):
+        if (text := text.strip().casefold()) != self.filter:
+            self.beginResetModel()
+            self.filter = text
+            self._apply_filter()
+            self.endResetModel()
+
+
+    def _apply_filter(self):
+        for group, names in enumerate(self._items):
+            if self.filter:
+                names = [name for name in names
+                         if self.filter in name.casefold()]
+            self._names[group] = names
+            self._rows[group] = {name: row for row, name in
+                                 enumerate(names)}
+
+
+    def item(self, index): # Returns (kind, name) or None for a group
+        if not index.isValid() or (key := index.internalId()) == 0:
+            return None
+        if key < COLUMNS:
+            return (GROUPS[key - 1][1],
+                    self._names[key - 1][index.row()])
+        return 'column', self._columns[key - COLUMNS][index.row()].name
+
+
+    def is_table(self, index):
+        return index.isValid() and index.internalId() == TABLES + 1
+
+
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        if (key := parent.internalId()) == 0:
+            return self.createIndex(row, column, parent.row() + 1)
+        name = self._names[key - 1][parent.row()]
+        return self.createIndex(row, column, COLUMNS + self._ids[name])
+
+
+    def parent(self, index):
+        if not index.isValid() or (key := index.internalId()) == 0:
+            return QModelIndex()
+        if key < COLUMNS:
+            return self.createIndex(key - 1, 0, 0)
+        table = self._tables[key - COLUMNS]
+        return self.createIndex(self._rows[TABLES][table], 0, TABLES + 1)
+
+
+    def rowCount(self, parent=QModelIndex()):
+        if not parent.isValid():
+            return len(GROUPS)
+        if parent.column() > 0:
+            return 0
+        if parent.internalId() == 0:
+            return len(self._names[parent.row()])
+        if self.is_table(parent) and (n := self._ids.get(
+                self._names[TABLES][parent.row()])) is not None:
+            return len(self._columns[n])
+        return 0
+
+
+    def columnCount(self, parent=QModelIndex()):
+        return 2 # name, type
+
+
+    def hasChildren(self, parent=QModelIndex()):
+        if self.canFetchMore(parent) and parent.column() == 0:
+            return True # Until its columns are read we don't know
+        return super().hasChildren(parent)
+
+
+    def canFetchMore(self, parent):
+        return self.is_table(parent) and (
+            self._names[TABLES][parent.row()] not in self._ids)
+
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        name = self._names[TABLES][parent.row()]
+        columns = self.db.item_detail(name)
+        if columns:
+            self.beginInsertRows(parent, 0, len(columns) - 1)
+        self._ids[name] = len(self._tables)
+        self._tables.append(name)
+        self._columns.append(columns)
+        if columns:
+            self.endInsertRows()
+
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        key = index.internalId()
+        if key < COLUMNS:
+            if role == Qt.DisplayRole and index.column() == 0:
+                if key == 0:
+                    return GROUPS[index.row()][0]
+                return self._names[key - 1][index.row()]
+            return None
+        detail = self._columns[key - COLUMNS][index.row()]
+        if role == Qt.DisplayRole:
+            return detail.name if index.column() == 0 else (
+                detail.type.upper())
+        if role == Qt.ForegroundRole and index.column() == 0:
+            if detail.pk:
+                return QBrush(Qt.darkGreen)
+            return QBrush(Qt.black if detail.notnull else Qt.darkGray)
+        if role == Qt.FontRole and index.column() == 1:
+            font = QFont()
+            font.setPointSize(max(6, font.pointSize() - 1))
+            return font
+        return None
@@ -1,29 +1,34 @@
 #!/usr/bin/env python3
 # Copyright © 2020 Mark Summerfield. All rights reserved.
 
-from PySide2.QtGui import QBrush, Qt
-from PySide2.QtWidgets import QHeaderView, QTreeWidget, QTreeWidgetItem
+from PySide2.QtCore import Signal
+from PySide2.QtWidgets import (
+    QHeaderView, QLineEdit, QTreeView, QVBoxLayout, QWidget)
 
 from TableWidget import TableWidget
+from Ui import BlockSignals
+
+from .ItemsTreeModel import TABLES, ItemsTreeModel
 
 
 class Mixin:
 
-    def refresh_items(self):
-        self.itemsTreeDock.widget().refresh()
+    def refresh_items(self, *, reset=False):
+        # Unless reset, does nothing if the schema hasn't changed
+        changed = None if reset else self.db.refresh()
+        if changed is None or changed:
+            self.itemsTreeDock.widget().refresh(changed)
+            self.completions.refresh(self.db, changed)
 
 
-    def maybe_show_item(self, item, _=None):
-        if item.parent() is None:
-            return # Ignore top-level items
-        kind = item.parent().text(0).lower()[:-1]
-        name = item.text(0)
+    def maybe_show_item(self, kind, name):
         sub_window = self.findSubWindow(name)
         if sub_window is None:
             if kind in {'table', 'view'}:
                 sql = self.db.select_make(kind, name)
                 widget = TableWidget(self.db, f'{name} ({kind})', sql,
-                                     self.edit_update_ui)
+                                     self.edit_update_ui,
+                                     completions=self.completions)
                 sub_window = self.mdiArea.addSubWindow(widget)
                 widget.show()
             else:
@@ -33,83 +38,102 @@ class Mixin:
             self.mdiArea.setActiveSubWindow(sub_window)
 
 
-class View(QTreeWidget):
+class View(QWidget):
+
+    # item_activated is emitted with the item's kind and name when an
+    # item (but not a group or column) is double-clicked
+    item_activated = Signal(str, str)
+    current_changed = Signal()
 
     def __init__(self, db):
         super().__init__()
         self.db = db
-        self.setHeaderHidden(True)
-        self.setSelectionBehavior(QTreeWidget.SelectRows)
-        self.setSelectionMode(QTreeWidget.SingleSelection)
-        self.setAlternatingRowColors(True)
-
-
-    def refresh(self):
-        self.clear()
-        if bool(self.db):
-            self._prepare()
-            self.queryItem = QTreeWidgetItem(self, ('Queries',))
-            tableItem = QTreeWidgetItem(self, ('Tables',))
-            viewItem = QTreeWidgetItem(self, ('Views',))
-            triggerItem = QTreeWidgetItem(self, ('Triggers',))
-            indexItem = QTreeWidgetItem(self, ('Indexes',))
-            firstItem = None
-            for item in self.db.item_summary():
-                new_item = QTreeWidgetItem((item.name,))
-                if item.kind == 'table':
-                    parent = tableItem
-                    self._add_table_item(item.name, new_item, parent)
-                    if firstItem is None:
-                        firstItem = new_item
-                elif item.kind == 'view':
-                    parent = viewItem
-                elif item.kind == 'trigger':
-                    parent = triggerItem
-                elif item.kind == 'index':
-                    parent = indexItem
-                parent.addChild(new_item)
-            for item in (self.queryItem, tableItem, viewItem):
-                if item.childCount() < 11:
-                    self.expandItem(item)
-            if firstItem is not None:
-                self.setCurrentItem(firstItem)
-
-
-    def _prepare(self):
-        self.setColumnCount(2)
-        header = self.header()
+        self.make_widgets()
+        self.make_layout()
+        self.make_connections()
+
+
+    def make_widgets(self):
+        self.filterEdit = QLineEdit()
+        self.filterEdit.setPlaceholderText('Filter')
+        self.filterEdit.setClearButtonEnabled(True)
+        self.filterEdit.setToolTip('Show only the items whose names '
+                                   'contain the text typed')
+        self.model = ItemsTreeModel(self.db, self)
+        self.treeView = QTreeView()
+        self.treeView.setModel(self.model)
+        self.treeView.setHeaderHidden(True)
+        self.treeView.setUniformRowHeights(True) # Faster for big trees
+        self.treeView.setSelectionBehavior(QTreeView.SelectRows)
+        self.treeView.setSelectionMode(QTreeView.SingleSelection)
+        self.treeView.setAlternatingRowColors(True)
+        header = self.treeView.header()
         header.setStretchLastSection(False)
         header.setSectionResizeMode(0, QHeaderView.ResizeToContents)
         header.setSectionResizeMode(1, QHeaderView.ResizeToContents)
+        self.setFocusProxy(self.treeView)
 
 
-    def _add_table_item(self, tablename, item, parent):
-        for detail in self.db.item_detail(tablename):
-            if detail.pk:
-                color = Qt.darkGreen
-            elif detail.notnull:
-                color = Qt.black
-            else:
-                color = Qt.darkGray
-            child = QTreeWidgetItem((detail.name, detail.type.upper()))
-            child.setForeground(0, QBrush(color))
-            font = child.font(1)
-            font.setPointSize(max(6, font.pointSize() - 1))
-            child.setFont(1, font)
-            item.addChild(child)
+    def make_layout(self):
+        vbox = QVBoxLayout()
+        vbox.setContentsMargins(0, 0, 0, 0)
+        vbox.addWidget(self.filterEdit)
+        vbox.addWidget(self.treeView)
+        self.setLayout(vbox)
+
+
+    def make_connections(self):
+        self.filterEdit.textChanged.connect(self.on_filter)
+        self.treeView.doubleClicked.connect(self.on_double_clicked)
+        self.treeView.selectionModel().currentChanged.connect(
+            self.current_changed)
+
+
+    def refresh(self, changed=None): # See ItemsTreeModel.refresh()
+        if changed is None: # A different database (or none)
+            with BlockSignals(self.filterEdit):
+                self.filterEdit.clear()
+            self.model.set_filter('')
+        self.model.refresh(changed)
+        self._expand()
+        tables = self.model.index(TABLES, 0)
+        if self.model.rowCount(tables):
+            self.treeView.setCurrentIndex(self.model.index(0, 0, tables))
+
+
+    def on_filter(self, text):
+        self.model.set_filter(text)
+        self._expand()
+
+
+    def _expand(self):
+        for row in range(self.model.rowCount()):
+            index = self.model.index(row, 0)
+            if self.model.filter or self.model.rowCount(index) < 11:
+                self.treeView.expand(index)
+
+
+    def on_double_clicked(self, index):
+        if (item := self.model.item(index)) is not None and (
+                item[0] != 'column'):
+            self.item_activated.emit(*item)
+
+
+    @property
+    def current_item(self): # (kind, name) or None
+        return self.model.item(self.treeView.currentIndex())
 
 
     def copy(self):
-        item = self.currentItem()
-        if item is not None and item.parent() is not None:
+        if (item := self.current_item) is not None:
             clipboard = qApp.clipboard()
-            clipboard.setText(item.text(0))
+            clipboard.setText(item[1])
 
 
     def canCopy(self):
-        return self.can_view()
+        return self.current_item is not None
 
 
     def can_view(self):
-        return (self.currentItem() is not None and
-                self.currentItem().parent() is not None)
+        return (item := self.current_item) is not None and (
+            item[0] != 'column')
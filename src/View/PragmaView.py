@@ -6,14 +6,18 @@ import pathlib
 
 from PySide2.QtCore import Qt
 from PySide2.QtWidgets import (
-    QFormLayout, QGroupBox, QLabel, QMessageBox, QSpinBox,
+    QComboBox, QFormLayout, QGroupBox, QLabel, QMessageBox, QSpinBox,
     QVBoxLayout, QWidget)
 
 import Config
 from Const import APPNAME, MAX_I32
-from Db.Sql import Pragmas
+from Db.Sql import JOURNAL_MODES, Pragmas
 from Ui import BlockSignals
 
+PAGE_SIZES = tuple(512 << i for i in range(8)) # 512 to 65536
+SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+TEMP_STORES = ('DEFAULT', 'FILE', 'MEMORY')
+
 
 class Mixin:
 
@@ -26,7 +30,7 @@ class View(QWidget):
     def __init__(self, db):
         super().__init__()
         self.db = db
-        self.pragmas = Pragmas.unchanged()
+        self.pragmas = Pragmas.unchanged() # The unsaved persistent ones
         self.dirty = False
         self.make_widgets()
         self.make_layout()
@@ -36,15 +40,77 @@ class View(QWidget):
     def make_widgets(self):
         self.userVersionSpinbox = QSpinBox()
         self.userVersionSpinbox.setRange(0, MAX_I32)
-        # TODO make all widgets
+        self.journalModeComboBox = QComboBox()
+        self.journalModeComboBox.addItems([mode.upper()
+                                           for mode in JOURNAL_MODES])
+        self.journalModeComboBox.setToolTip(
+            'WAL lets reading and writing happen at the same time')
+        self.pageSizeComboBox = QComboBox()
+        for size in PAGE_SIZES:
+            self.pageSizeComboBox.addItem(f'{size:,} B', size)
+        self.pageSizeComboBox.setToolTip(
+            'Only takes effect for a new database or after VACUUM when '
+            'not in WAL mode')
+        self.cacheSizeSpinbox = QSpinBox()
+        self.cacheSizeSpinbox.setRange(1, MAX_I32)
+        self.cacheSizeSpinbox.setSingleStep(1024)
+        self.cacheSizeSpinbox.setSuffix(' KB')
+        self.mmapSizeSpinbox = QSpinBox()
+        self.mmapSizeSpinbox.setRange(0, MAX_I32)
+        self.mmapSizeSpinbox.setSingleStep(64)
+        self.mmapSizeSpinbox.setSuffix(' MB')
+        self.mmapSizeSpinbox.setToolTip(
+            'How much of the database to access via memory mapping')
+        self.synchronousComboBox = QComboBox()
+        self.synchronousComboBox.addItems(SYNCHRONOUS)
+        self.synchronousComboBox.setToolTip(
+            'NORMAL is safe and faster in WAL mode')
+        self.tempStoreComboBox = QComboBox()
+        self.tempStoreComboBox.addItems(TEMP_STORES)
+        self.walAutocheckpointSpinbox = QSpinBox()
+        self.walAutocheckpointSpinbox.setRange(0, MAX_I32)
+        self.walAutocheckpointSpinbox.setSuffix(' pages')
+        self.walAutocheckpointSpinbox.setSpecialValueText('Off')
+        self.threadsSpinbox = QSpinBox()
+        self.threadsSpinbox.setRange(0, 64)
+        self.threadsSpinbox.setToolTip(
+            'Extra threads SQLite may use, e.g., for big sorts')
+        for spinbox in (self.cacheSizeSpinbox, self.mmapSizeSpinbox,
+                        self.walAutocheckpointSpinbox, self.threadsSpinbox):
+            spinbox.setKeyboardTracking(False) # Apply once entered
         self.pathLabel = QLabel()
         self.configLabel = QLabel(Config.filename())
 
 
+    @property
+    def pragma_widgets(self):
+        return self.persistent_widgets + self.connection_widgets
+
+
+    @property
+    def persistent_widgets(self): # Saved in the database by save()
+        return (self.userVersionSpinbox, self.journalModeComboBox,
+                self.pageSizeComboBox)
+
+
+    @property
+    def connection_widgets(self): # Applied at once (see apply())
+        return (self.cacheSizeSpinbox, self.mmapSizeSpinbox,
+                self.synchronousComboBox, self.tempStoreComboBox,
+                self.walAutocheckpointSpinbox, self.threadsSpinbox)
+
+
     def make_layout(self):
         form = QFormLayout()
         form.addRow('User Version', self.userVersionSpinbox)
-        # TODO add all widgets
+        form.addRow('Journal Mode', self.journalModeComboBox)
+        form.addRow('Page Size', self.pageSizeComboBox)
+        form.addRow('Cache Size', self.cacheSizeSpinbox)
+        form.addRow('Memory Map Size', self.mmapSizeSpinbox)
+        form.addRow('Synchronous', self.synchronousComboBox)
+        form.addRow('Temp Store', self.tempStoreComboBox)
+        form.addRow('WAL Autocheckpoint', self.walAutocheckpointSpinbox)
+        form.addRow('Threads', self.threadsSpinbox)
         self._add_grouped(form, 'Database Path', self.pathLabel)
         self._add_grouped(form, 'Configuration File', self.configLabel)
         self.setLayout(form)
@@ -60,7 +126,19 @@ class View(QWidget):
 
     def make_connections(self):
         self.userVersionSpinbox.valueChanged.connect(self.on_user_version)
-        # TODO connect all widgets (excl. configLabel)
+        self.journalModeComboBox.currentIndexChanged.connect(
+            self.on_journal_mode)
+        self.pageSizeComboBox.currentIndexChanged.connect(
+            self.on_page_size)
+        self.cacheSizeSpinbox.valueChanged.connect(self.on_cache_size)
+        self.mmapSizeSpinbox.valueChanged.connect(self.on_mmap_size)
+        self.synchronousComboBox.currentIndexChanged.connect(
+            self.on_synchronous)
+        self.tempStoreComboBox.currentIndexChanged.connect(
+            self.on_temp_store)
+        self.walAutocheckpointSpinbox.valueChanged.connect(
+            self.on_wal_autocheckpoint)
+        self.threadsSpinbox.valueChanged.connect(self.on_threads)
 
 
     def on_user_version(self):
@@ -68,25 +146,99 @@ class View(QWidget):
         self.dirty = True
 
 
+    def on_journal_mode(self):
+        self.pragmas.journal_mode = (
+            self.journalModeComboBox.currentText().lower())
+        self.dirty = True
+
+
+    def on_page_size(self):
+        self.pragmas.page_size = self.pageSizeComboBox.currentData()
+        self.dirty = True
+
+
+    def on_cache_size(self):
+        self.apply(cache_size=-self.cacheSizeSpinbox.value()) # KB
+
+
+    def on_mmap_size(self):
+        self.apply(mmap_size=self.mmapSizeSpinbox.value() * 2**20)
+
+
+    def on_synchronous(self):
+        self.apply(synchronous=self.synchronousComboBox.currentIndex())
+
+
+    def on_temp_store(self):
+        self.apply(temp_store=self.tempStoreComboBox.currentIndex())
+
+
+    def on_wal_autocheckpoint(self):
+        self.apply(
+            wal_autocheckpoint=self.walAutocheckpointSpinbox.value())
+
+
+    def on_threads(self):
+        self.apply(threads=self.threadsSpinbox.value())
+
+
+    def apply(self, **kwargs):
+        # Connection pragmas only last as long as the connection and can
+        # be set even if it is read-only so they take effect at once
+        if bool(self.db):
+            if errors := self.db.pragmas_save(Pragmas.unchanged(**kwargs)):
+                error = '\n'.join(errors)
+                QMessageBox.warning(self, f'Pragma error — {APPNAME}',
+                                    f'Failed to apply pragma:\n{error}')
+            self.refresh_connection(self.db.pragmas()) # Those in effect
+
+
     def refresh(self):
         self.clear()
         if bool(self.db):
             pragmas = self.db.pragmas()
-            with BlockSignals(self):
+            with BlockSignals(*self.persistent_widgets):
                 self.userVersionSpinbox.setValue(pragmas.user_version)
-                # TODO refresh all widgets (excl. configLabel)
-                path = str(pathlib.Path(self.db.filename).parent)
-                if not path.endswith(('/', '\\')):
-                    path += os.sep
-                self.pathLabel.setText(path)
-        self.dirty = False
+                self.journalModeComboBox.setCurrentText(
+                    pragmas.journal_mode.upper())
+                self.pageSizeComboBox.setCurrentIndex(
+                    self.pageSizeComboBox.findData(pragmas.page_size))
+            self.refresh_connection(pragmas)
+            for widget in self.persistent_widgets:
+                widget.setEnabled(not self.db.readonly)
+            path = str(pathlib.Path(self.db.filename).parent)
+            if not path.endswith(('/', '\\')):
+                path += os.sep
+            self.pathLabel.setText(path)
+
+
+    def refresh_connection(self, pragmas):
+        with BlockSignals(*self.connection_widgets):
+            cache_size = pragmas.cache_size
+            if cache_size > 0: # pages
+                cache_size = -(cache_size * pragmas.page_size // 1024)
+            self.cacheSizeSpinbox.setValue(-cache_size)
+            self.mmapSizeSpinbox.setValue(pragmas.mmap_size // 2**20)
+            self.synchronousComboBox.setCurrentIndex(pragmas.synchronous)
+            self.tempStoreComboBox.setCurrentIndex(pragmas.temp_store)
+            self.walAutocheckpointSpinbox.setValue(
+                pragmas.wal_autocheckpoint)
+            self.threadsSpinbox.setValue(pragmas.threads)
 
 
     def clear(self):
-        with BlockSignals(self):
+        with BlockSignals(*self.pragma_widgets):
             self.userVersionSpinbox.setValue(0)
-            # TODO clear all widgets (excl. configLabel)
-            self.pathLabel.clear()
+            for comboBox in (
+                    self.journalModeComboBox, self.pageSizeComboBox,
+                    self.synchronousComboBox, self.tempStoreComboBox):
+                comboBox.setCurrentIndex(-1)
+            for spinbox in (self.cacheSizeSpinbox, self.mmapSizeSpinbox,
+                            self.walAutocheckpointSpinbox,
+                            self.threadsSpinbox):
+                spinbox.setValue(spinbox.minimum())
+        self.pathLabel.clear()
+        self.pragmas = Pragmas.unchanged()
         self.dirty = False
 
 
@@ -102,4 +254,6 @@ class View(QWidget):
             else:
                 saved = True
                 self.dirty = False
+            if not closing:
+                self.refresh() # Show the values now in effect
         return saved
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Mark Summerfield. All rights reserved.
+
+import threading
+import weakref
+
+from PySide2.QtCore import QObject, QThread, Signal, Slot
+
+import apsw
+from Const import WORKERS_MAX
+from Db import Sql
+
+_THREADS = weakref.WeakKeyDictionary() # Db → its _Threads
+
+
+class Worker(QObject):
+
+    # Each job is a function that is given a read-only Db borrowed from
+    # the caller's Db and is run in another thread; the job's key is
+    # passed back with its result or error so the caller can match them
+    # up. A Db's Workers share at most WORKERS_MAX threads (each with its
+    # own reader) and each Worker's jobs are run in order in one thread
+    done = Signal(object, object) # key, result
+    failed = Signal(object, str) # key, error
+
+    def __init__(self, db):
+        super().__init__()
+        threads = _THREADS.setdefault(db, [])
+        if len(threads) < WORKERS_MAX: # Those there are are all in use
+            threads.append(_Thread(db))
+        self._thread = min(threads, key=lambda thread: len(thread.workers))
+        self._thread.workers.add(self)
+        self._serial = 0 # Of the last job submitted
+        self._skip = 0 # Jobs with serials up to this are cancelled
+
+
+    def submit(self, key, function):
+        self._serial += 1
+        self._thread.requested.emit(self, self._serial, key,
+                                    function) # Queued
+
+
+    def cancel(self): # Skip every job submitted so far
+        self._skip = self._serial
+        self._thread.interrupt(self) # Stop its job that's running (if any)
+
+
+    def stop(self): # Jobs submitted since the last cancel() are still run
+        self._thread.remove(self)
+
+
+class _Thread(QObject):
+
+    # Runs the jobs of the Workers that share it using its reader; each
+    # request is (worker, serial, key, function)
+    requested = Signal(object, int, object, object)
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.db = pool.reader()
+        self.workers = set()
+        self._lock = threading.Lock() # For _running
+        self._running = None # The Worker whose job is running
+        self._thread = QThread()
+        self.moveToThread(self._thread)
+        self.requested.connect(self._run)
+        self._thread.start()
+
+
+    @Slot(object, int, object, object)
+    def _run(self, worker, serial, key, function):
+        if worker is None: # After every job submitted before stop()
+            self._thread.quit()
+            return
+        if serial <= worker._skip:
+            return
+        with self._lock:
+            self._running = worker
+        try:
+            result = function(self.db)
+        except (apsw.Error, Sql.Error) as err:
+            worker.failed.emit(key, str(err))
+        else:
+            worker.done.emit(key, result)
+        finally:
+            with self._lock:
+                self._running = None
+
+
+    def interrupt(self, worker):
+        with self._lock:
+            if self._running is worker:
+                self.db.interrupt()
+
+
+    def remove(self, worker):
+        self.workers.discard(worker)
+        if not self.workers:
+            if (threads := _THREADS.get(self.pool)) is not None:
+                threads.remove(self)
+            self.requested.emit(None, 0, None, None) # Quit when done
+            self._thread.wait()
+            self.pool.release(self.db)
@@ -10,16 +10,30 @@ from PySide2.QtWidgets import QApplication
 
 from AppData import ICON_SVG, get_icon
 from Const import APPNAME, VERSION
+from Db.Sql import OpenOptions
 from MainWindow import Window
 
 
 def main():
     filename = None
+    options = OpenOptions()
     for arg in sys.argv[1:]:
         if arg in {'-h', '--help'}:
             raise SystemExit(USAGE)
         if arg in {'-D', '--debug'}:
             _messageHandler.debug = True
+        elif arg in {'-r', '--readonly'}:
+            options = options._replace(readonly=True)
+        elif arg in {'-i', '--immutable'}:
+            options = options._replace(immutable=True)
+        elif arg.startswith(('--mmap=', '--cache=')):
+            name, size = arg[2:].split('=', 1)
+            try:
+                if (size := int(size)) < 0:
+                    raise ValueError
+            except ValueError:
+                raise SystemExit(f'invalid size: {arg}\n\n{USAGE}')
+            options = options._replace(**{f'{name}_mb': size})
         else:
             filename = arg
     app = QApplication(sys.argv)
@@ -28,18 +42,25 @@ def main():
     app.setApplicationName(APPNAME)
     app.setApplicationVersion(VERSION)
     app.setWindowIcon(get_icon(ICON_SVG))
-    window = Window.Window(filename)
+    window = Window.Window(filename, options)
     window.show()
     sys.exit(app.exec_())
 
 
-USAGE = f'''usage: {pathlib.Path(sys.argv[0]).name} [filename]
+USAGE = f'''usage: {pathlib.Path(sys.argv[0]).name} [options] [filename]
 
 An easy to use GUI application for viewing, creating, editing, and updating
 SQLite and {APPNAME} databases.
 
 filename must be a SQLite or Songbird database
-         (typically .db, .db3, .sqlite, .sqlite3, .sb)'''
+         (typically .db, .db3, .sqlite, .sqlite3, .sb)
+
+options (for the database opened at startup):
+-r --readonly  open the database read-only
+-i --immutable open the database read-only on the assumption that no
+               program will ever change it (so no locking is needed)
+--mmap=MB      memory map up to MB megabytes of the database
+--cache=MB     use a page cache of up to MB megabytes'''
 
 
 def _messageHandler(kind, context, message):